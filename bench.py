@@ -0,0 +1,993 @@
+""" bench.py
+
+Benchmarks for the functions in main.py. Run with
+
+    python bench.py
+
+or, for the whole pipeline on synthetic data (see `main_suite`),
+
+    python bench.py suite
+
+"""
+import argparse
+import functools
+import glob
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import main
+
+
+# ----------------------------------------------------------------------------
+#   Reference implementations (kept only to compare against)
+# ----------------------------------------------------------------------------
+def dat_to_df_loop(pth, src_cols, src_col_dtypes, src_col_widths):
+    """ The original row-by-row DAT parser, which slices each row string
+    once per column.
+
+    """
+    dat_file_rows = open(pth).read().strip().split("\n")
+    parsed_dat_file = []
+    parsed_dates_index = []
+    parsed_dat_columns = []
+    for row in dat_file_rows:
+        current_row = row
+        current_parsed_data = []
+        for col in src_cols:
+            col_width = src_col_widths[col]
+            col_data = current_row[:col_width]
+            current_row = current_row[col_width:]
+            if col == "date":
+                parsed_dates_index.append(col_data)
+            else:
+                current_parsed_data.append(col_data)
+                if not parsed_dat_columns.__contains__(col):
+                    parsed_dat_columns.append(col)
+        parsed_dat_file.append(current_parsed_data)
+
+    df = pd.DataFrame(parsed_dat_file, pd.DatetimeIndex(parsed_dates_index), parsed_dat_columns)
+    df.sort_index(inplace=True)
+    return(df)
+
+
+def mk_aret_df_loop(prc_df):
+    """ The original abnormal return computation, which writes one column of
+    the joined dataframe at a time.
+
+    """
+    ret_df = prc_df.pct_change(fill_method=None)
+    ff_df = main.read_ff_df(main.FF_CSV, main.CACHEDIR)
+    aret_df = ret_df.join(ff_df.mkt, how='inner')
+    for j, tic in enumerate(ret_df.columns):
+        aret_df.iloc[:, j] = aret_df.iloc[:, j] - aret_df.loc[:, 'mkt']
+    del aret_df['mkt']
+    return aret_df
+
+
+def batch_ols_loop(y, X):
+    """ Same as `main.batch_ols`, with one `np.linalg.lstsq` call per
+    regression.
+
+    """
+    coefs = np.full((X.shape[0], X.shape[2]), np.nan)
+    for e in range(len(y)):
+        valid = ~(np.isnan(y[e]) | np.isnan(X[e]).any(axis=1))
+        if valid.sum() > X.shape[2]:
+            coefs[e] = np.linalg.lstsq(X[e][valid], y[e][valid], rcond=None)[0]
+    return coefs
+
+
+def read_rec_csv_naive(pth):
+    """ A straightforward recommendations reader: all columns, inferred
+    timestamps, object strings and one formatted 'event_day' per row.
+
+    """
+    df = pd.read_csv(pth, index_col='Date', parse_dates=['Date'])
+    df.loc[:, 'event_day'] = [d.strftime('%Y-%m-%d') for d in df.index]
+    df = df.rename(columns={'Firm': 'firm', 'Action': 'action'})
+    return df.loc[:, ['event_day', 'firm', 'action']]
+
+
+def mk_events_str(rec_df):
+    """ `proc_rec_df` + `mk_event_df` on object-dtype strings, with the
+    sort-based top 30 selection.
+
+    """
+    rec_df = rec_df.astype({'firm': object, 'action': object})
+    counts = rec_df.groupby('firm').size().reset_index(name='n')
+    top = counts.sort_values(['n', 'firm'], ascending=[False, True]).firm.iloc[:30]
+    rec_df = rec_df.loc[rec_df.firm.isin(top), ['event_day', 'firm', 'action']]
+    rec_df = rec_df.loc[rec_df.action.isin(['up', 'down'])]
+    rec_df = rec_df.assign(score=rec_df.action.map({'up': 1, 'down': -1}))
+    event_df = rec_df.groupby(['event_day', 'firm'])['score'].sum().reset_index()
+    event_df['event_type'] = np.where(event_df.score > 0, 'upgrade',
+                                      np.where(event_df.score < 0, 'downgrade', ''))
+    event_df = event_df.loc[event_df.event_type != ''].reset_index(drop=True)
+    event_df.insert(0, 'event_id', range(1, len(event_df) + 1))
+    return event_df.loc[:, ['event_id', 'event_day', 'firm', 'event_type']]
+
+
+def mk_ret_dates_loop(event_df, window=2):
+    """ Builds the event windows with Python-level work per event, as the
+    original groupby/apply expansion did.
+
+    """
+    groups = []
+    for _, group in event_df.groupby('event_id'):
+        group = group.loc[group.index.repeat(2 * window + 1)].copy()
+        group.loc[:, 'event_time'] = list(range(-window, window + 1))
+        groups.append(main.mk_ret_dates_by_group(group))
+    df = pd.concat(groups)
+    df.index = range(len(df.index))
+    return df
+
+
+def cars_join(event_df, tic, aret_df):
+    """ Adds abnormal returns to the calendar-day windows of `event_df` by
+    joining on 'ret_date', as `mk_cars` originally did, and sums them.
+
+    """
+    event_df = main.mk_ret_dates(event_df)
+    aret_tic = aret_df.loc[:, [tic]].copy()
+    aret_tic.loc[:, 'ret_date'] = aret_tic.index.values
+    aret_tic.rename(columns={tic: 'aret'}, inplace=True)
+    event_df = event_df.join(aret_tic, how='inner', on='ret_date', rsuffix='_')
+    return event_df.groupby(['event_id', 'event_type'], observed=True)['aret'].sum()
+
+
+def cars_pos(event_df, tic, aret_df):
+    """ Same as `cars_join`, with trading-day windows read by position
+
+    """
+    event_df = main.mk_ret_dates(event_df, calendar=aret_df.index)
+    event_df = event_df.loc[event_df['ret_pos'].values >= 0]
+    event_df.loc[:, 'aret'] = aret_df[tic].values[event_df['ret_pos'].values]
+    return event_df.groupby(['event_id', 'event_type'], observed=True)['aret'].sum()
+
+
+# ----------------------------------------------------------------------------
+#   Synthetic data
+# ----------------------------------------------------------------------------
+# Firms and actions of the synthetic recommendations (the first firms are the
+# most active, so the top 30 selection has something to drop)
+SYNTH_FIRMS = ['Firm {:03d}'.format(i) for i in range(60)]
+SYNTH_ACTIONS = ['up', 'down', 'init', 'main', 'reit']
+
+
+def fw_floats(values, width):
+    """ Formats `values` as zero-padded numbers of exactly `width` characters
+    (extra decimals are cut), as in the DAT files. Returns an array of
+    bytes.
+
+    """
+    text = np.char.mod('%0{}.{}f'.format(width, width - 2), values)
+    return np.char.encode(text, 'ascii').astype('S{}'.format(width))
+
+
+def write_synth_dat(pth, dates, prices, rng):
+    """ Writes a DAT file at `pth` with one row per date in `dates`, in the
+    72 character layout of `main.SRC_COLS` and `main.SRC_COL_WIDTHS`, from
+    the adjusted closing prices `prices`
+
+    """
+    widths = main.SRC_COL_WIDTHS
+    n = len(dates)
+    fields = {
+        'low': fw_floats(prices * (1 - rng.uniform(0, 0.02, n)), widths['low']),
+        'adjClose': fw_floats(prices, widths['adjClose']),
+        'volume': np.char.encode(np.char.mod('%0{}d'.format(widths['volume']),
+                                             rng.integers(1, 10 ** 6, n)), 'ascii'),
+        'date': np.char.encode(np.char.add(' ', np.datetime_as_string(dates, unit='D')),
+                               'ascii'),
+        'open': fw_floats(prices * (1 + rng.normal(0, 0.01, n)), widths['open']),
+        'close': fw_floats(prices * (1 + rng.normal(0, 0.01, n)), widths['close']),
+    }
+    # One uint8 column block per field, then a '\n' at the end of each row
+    blocks = [fields[col].astype('S{}'.format(widths[col])).view(np.uint8).reshape(n, widths[col])
+              for col in main.SRC_COLS]
+    blocks.append(np.full((n, 1), ord('\n'), dtype=np.uint8))
+    with open(pth, 'wb') as fobj:
+        fobj.write(np.hstack(blocks).tobytes())
+
+
+def write_synth_rec(pth, first, last, n_recs, rng):
+    """ Writes a _rec.csv file at `pth` with `n_recs` recommendations between
+    the dates `first` and `last`
+
+    """
+    span = (last - first) // np.timedelta64(1, 's')
+    stamps = np.sort(first.astype('datetime64[s]') + rng.integers(0, span, n_recs))
+    weights = 1 / np.arange(1, len(SYNTH_FIRMS) + 1)
+    df = pd.DataFrame({
+        'Date': np.datetime_as_string(stamps, unit='s'),
+        'Firm': rng.choice(SYNTH_FIRMS, n_recs, p=weights / weights.sum()),
+        'To Grade': 'Buy',
+        'From Grade': '',
+        'Action': rng.choice(SYNTH_ACTIONS, n_recs, p=[0.25, 0.25, 0.1, 0.35, 0.05]),
+    })
+    df['Date'] = df['Date'].str.replace('T', ' ')
+    df.to_csv(pth, index=False)
+
+
+def write_synth_ff(pth, dates, rng):
+    """ Writes a ff_daily.csv file at `pth` with random factors for `dates`
+
+    """
+    n = len(dates)
+    df = pd.DataFrame({
+        'Date': np.datetime_as_string(dates, unit='D'),
+        'mkt-rf': rng.normal(0.0004, 0.01, n),
+        'smb': rng.normal(0, 0.005, n),
+        'hml': rng.normal(0, 0.005, n),
+        'rf': np.full(n, 0.0001),
+    })
+    df['mkt'] = df['mkt-rf'] + df['rf']
+    df.to_csv(pth, index=False)
+
+
+def mk_synth_data(root, n_tickers=50, n_years=10, n_recs=300, seed=0):
+    """ Creates a synthetic data set in the folder `root`: a TICKERS.txt
+    file, a `data` folder with `<tic>_prc.dat` and `<tic>_rec.csv` for each
+    ticker, and `data/ff_daily.csv`.
+
+    Every ticker has `n_years` years of business days (some start later,
+    as after an IPO) and `n_recs` recommendations. The same arguments
+    always create the same files.
+
+    Returns
+    -------
+    tuple
+        The paths of the TICKERS.txt file, of the data folder and of the
+        ff_daily.csv file
+
+    """
+    rng = np.random.default_rng(seed)
+    srcdir = os.path.join(root, 'data')
+    os.makedirs(srcdir, exist_ok=True)
+    dates = pd.bdate_range(end='2020-12-31', periods=252 * n_years).values.astype('datetime64[D]')
+    tickers = ['s{:04d}'.format(i) for i in range(n_tickers)]
+    for tic in tickers:
+        first = int(rng.integers(0, len(dates) // 4))
+        rets = rng.normal(0.0003, 0.02, len(dates) - first)
+        prices = 50 * np.exp(np.cumsum(rets))
+        write_synth_dat(os.path.join(srcdir, tic + '_prc.dat'), dates[first:], prices, rng)
+        write_synth_rec(os.path.join(srcdir, tic + '_rec.csv'), dates[first], dates[-1],
+                        n_recs, rng)
+    ff_csv = os.path.join(srcdir, 'ff_daily.csv')
+    write_synth_ff(ff_csv, dates, rng)
+    tickers_pth = os.path.join(root, 'TICKERS.txt')
+    with open(tickers_pth, 'w') as fobj:
+        fobj.write('\n'.join(tic.upper() for tic in tickers) + '\n')
+    return tickers_pth, srcdir, ff_csv
+
+
+# ----------------------------------------------------------------------------
+#   Helpers
+# ----------------------------------------------------------------------------
+def best_of(func, repeat=5, number=1):
+    """ Returns the best wall time (in seconds) of `repeat` runs of `func`
+
+    """
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def report(name, base, new):
+    """ Prints one line comparing the time `base` against the time `new`
+
+    """
+    print("{:<40s} {:>10.2f} ms {:>10.2f} ms {:>8.1f}x".format(
+        name, base * 1e3, new * 1e3, base / new))
+
+
+def mk_rec_universe(srcdir, tickers, aret_df, tmpdir, n=500):
+    """ Copies the _rec.csv files of `tickers` into `tmpdir` as `n` tickers
+    t000, t001, ... and returns these tickers with a matching aret_df
+
+    """
+    universe = ['t{:03d}'.format(i) for i in range(n)]
+    for i, tic in enumerate(universe):
+        shutil.copy(os.path.join(srcdir, tickers[i % len(tickers)] + '_rec.csv'),
+                    os.path.join(tmpdir, tic + '_rec.csv'))
+    big_df = aret_df.iloc[:, np.arange(n) % len(tickers)].copy()
+    big_df.columns = universe
+    return universe, big_df
+
+
+# ----------------------------------------------------------------------------
+#   Benchmarks
+# ----------------------------------------------------------------------------
+def bench_dat_to_df(srcdir=main.SRCDIR):
+    """ Compares the vectorized `dat_to_df` against the row loop
+
+    """
+    args = (main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    print("\ndat_to_df: row loop vs vectorized")
+    for pth in [os.path.join(srcdir, 'aapl_prc.dat')]:
+        base = best_of(lambda: dat_to_df_loop(pth, *args))
+        new = best_of(lambda: main.dat_to_df(pth, *args))
+        report(os.path.basename(pth), base, new)
+
+    pths = sorted(glob.glob(os.path.join(srcdir, '*_prc.dat')))
+    base = best_of(lambda: [dat_to_df_loop(p, *args) for p in pths], repeat=3)
+    new = best_of(lambda: [main.dat_to_df(p, *args) for p in pths], repeat=3)
+    report("all {} files".format(len(pths)), base, new)
+
+
+def bench_usecols(srcdir=main.SRCDIR, tickers_pth=main.TICKERS):
+    """ Compares parsing every column of each ticker's DAT file against
+    parsing only 'date' and 'adjClose' (what `mk_prc_df` needs)
+
+    """
+    args = (main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    kargs = {'use_mmap': True, 'usecols': ['date', 'adjClose']}
+    print("\ndat_to_df: all columns vs date + adjClose")
+    total_base = total_new = 0
+    for tic in main.get_tics(tickers_pth):
+        pth = os.path.join(srcdir, tic.lower() + '_prc.dat')
+        base = best_of(lambda: main.dat_to_df(pth, *args))
+        new = best_of(lambda: main.dat_to_df(pth, *args, **kargs))
+        report(tic.lower(), base, new)
+        total_base += base
+        total_new += new
+    report("total", total_base, total_new)
+
+
+def bench_workers(srcdir=main.SRCDIR, tickers_pth=main.TICKERS,
+                  workers=(1, 2, 4, 8)):
+    """ Times `mk_prc_df` with different numbers of worker processes, for the
+    tickers in TICKERS.txt and for a 500 ticker universe (the same files
+    repeated)
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    universe = (tickers * (500 // len(tickers) + 1))[:500]
+    args = (srcdir, main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    print("\nmk_prc_df: scaling with workers ({} CPUs)".format(os.cpu_count()))
+    for tics in [tickers, universe]:
+        base = None
+        for n in workers:
+            new = best_of(lambda: main.mk_prc_df(tics, *args, workers=n), repeat=3)
+            base = base or new
+            report("{} tickers, {} workers".format(len(tics), n), base, new)
+
+
+def bench_cache(srcdir=main.SRCDIR, tickers_pth=main.TICKERS):
+    """ Times loading the prices and the FF factors with an empty cache
+    (cold), a full cache (warm) and a full cache where one DAT file changed,
+    then the whole of `main.main` with an empty and a full cache
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    print("\nload prices + FF factors: cold vs warm cache")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Work on a copy of the data so the source files can be touched
+        datadir = os.path.join(tmpdir, 'data')
+        cache_dir = os.path.join(tmpdir, 'cache')
+        shutil.copytree(srcdir, datadir)
+        ff_csv = os.path.join(datadir, os.path.basename(main.FF_CSV))
+
+        def load():
+            main.mk_prc_df(tickers, datadir, main.SRC_COLS, main.SRC_COL_DTYPES,
+                           main.SRC_COL_WIDTHS, cache_dir=cache_dir)
+            main.read_ff_df(ff_csv, cache_dir)
+
+        def load_cold():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            load()
+
+        def load_stale():
+            os.utime(os.path.join(datadir, tickers[0].lower() + '_prc.dat'))
+            load()
+
+        cold = best_of(load_cold, repeat=3)
+        report("warm cache", cold, best_of(load, repeat=3))
+        report("warm cache, one stale ticker", cold, best_of(load_stale, repeat=3))
+        report("cold cache", cold, cold)
+
+        # The FF factors kept in memory are cleared before each run, so the
+        # warm runs read the cache folder like a new process would
+        def run_main():
+            main.FF_STORE.clear()
+            main.main()
+
+        def run_main_cold():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            run_main()
+
+        print("\nmain(): cold vs warm cache")
+        old = main.SRCDIR, main.FF_CSV, main.CACHEDIR, main.PROFILE
+        main.SRCDIR, main.FF_CSV, main.CACHEDIR = datadir, ff_csv, cache_dir
+        main.PROFILE = False
+        try:
+            cold = best_of(run_main_cold, repeat=5)
+            report("warm cache", cold, best_of(run_main, repeat=5))
+        finally:
+            main.SRCDIR, main.FF_CSV, main.CACHEDIR, main.PROFILE = old
+            main.FF_STORE.clear()
+
+
+def bench_panel(srcdir=main.SRCDIR, tickers_pth=main.TICKERS):
+    """ Compares aligning the adjClose series with `pd.concat` against
+    `mk_panel`, for the tickers in TICKERS.txt and for 2000 columns (the
+    same series repeated)
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    args = (srcdir, main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    series = [main.read_adj_close(tic, *args) for tic in tickers]
+    print("\nprice panel: pd.concat vs mk_panel (time, then peak memory)")
+    for n_cols in [len(series), 2000]:
+        sers = (series * (n_cols // len(series) + 1))[:n_cols]
+        cols = list(range(n_cols))
+        base = best_of(lambda: pd.concat(sers, axis=1), repeat=3)
+        new = best_of(lambda: main.mk_panel(sers, cols), repeat=3)
+        report("{} columns".format(n_cols), base, new)
+        peaks = []
+        for func in [lambda: pd.concat(sers, axis=1), lambda: main.mk_panel(sers, cols)]:
+            tracemalloc.start()
+            func()
+            peaks.append(tracemalloc.get_traced_memory()[1] / 2**20)
+            tracemalloc.stop()
+        print("{:<40s} {:>10.1f} MB {:>10.1f} MB".format('', *peaks))
+
+
+def bench_incremental(srcdir=main.SRCDIR, tickers_pth=main.TICKERS):
+    """ Times a daily refresh (one row appended to every DAT file) done by
+    rebuilding the price and abnormal return dataframes, against doing it
+    with `update_prc_df` and `update_aret_df`
+
+    """
+    tickers = [tic.lower() for tic in main.get_tics(tickers_pth)]
+    args = (main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    print("\ndaily refresh: rebuild vs incremental update")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        datadir = os.path.join(tmpdir, 'data')
+        cache_dir = os.path.join(tmpdir, 'cache')
+        os.makedirs(datadir)
+
+        # Start from the files without their last row
+        last_rows = {}
+        for tic in set(tickers):
+            with open(os.path.join(srcdir, tic + '_prc.dat'), 'rb') as fobj:
+                rows = fobj.read().rstrip(b'\n').split(b'\n')
+            last_rows[tic] = rows[-1] + b'\n'
+            with open(os.path.join(datadir, tic + '_prc.dat'), 'wb') as fobj:
+                fobj.write(b'\n'.join(rows[:-1]) + b'\n')
+        prc_df = main.mk_prc_df(tickers, datadir, *args, cache_dir=cache_dir)
+        aret_df = main.mk_aret_df(prc_df)
+
+        # Then append the last row to every file
+        for tic, row in last_rows.items():
+            with open(os.path.join(datadir, tic + '_prc.dat'), 'ab') as fobj:
+                fobj.write(row)
+
+        # Keep the cache entries without the last row, so every timed update
+        # parses the appended row
+        shutil.copytree(cache_dir, cache_dir + '0')
+
+        def update():
+            shutil.rmtree(cache_dir)
+            shutil.copytree(cache_dir + '0', cache_dir)
+            start = timeit.default_timer()
+            new_prc_df = main.update_prc_df(prc_df, datadir, *args, cache_dir=cache_dir)
+            main.update_aret_df(aret_df, new_prc_df)
+            assert len(new_prc_df) == len(prc_df) + 1
+            return timeit.default_timer() - start
+
+        base = best_of(lambda: main.mk_aret_df(main.mk_prc_df(tickers, datadir, *args)),
+                       repeat=3)
+        new = min(update() for _ in range(3))
+        report("{} tickers, 1 new row each".format(len(tickers)), base, new)
+
+
+def bench_aret(srcdir=main.SRCDIR, tickers_pth=main.TICKERS):
+    """ Compares the column loop in `mk_aret_df` against the whole-panel
+    computation, for the tickers in TICKERS.txt and for 2000 columns (the
+    same prices repeated)
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    prc_df = main.mk_prc_df(tickers, srcdir, main.SRC_COLS, main.SRC_COL_DTYPES,
+                            main.SRC_COL_WIDTHS, cache_dir=main.CACHEDIR)
+    print("\nmk_aret_df: column loop vs whole panel")
+    for n_cols in [len(tickers), 2000]:
+        wide_df = pd.concat([prc_df] * (n_cols // len(tickers) + 1), axis=1).iloc[:, :n_cols]
+        base = best_of(lambda: mk_aret_df_loop(wide_df), repeat=3)
+        new = best_of(lambda: main.mk_aret_df(wide_df), repeat=3)
+        report("{} columns".format(n_cols), base, new)
+
+
+def bench_ff(ff_csv=main.FF_CSV):
+    """ Times loading the FF factors with the generic CSV reader against the
+    explicit date format, the binary cache and the in-process store
+
+    """
+    print("\nFF factors: generic read_csv vs factor store")
+    base = best_of(lambda: pd.read_csv(ff_csv, index_col='Date', parse_dates=['Date']))
+    report("explicit date format", base, best_of(lambda: main.read_ff_df(ff_csv)))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        main.read_ff_df(ff_csv, cache_dir)
+        report("binary cache", base, best_of(lambda: main.read_ff_df(ff_csv, cache_dir)))
+    main.get_ff_df(ff_csv)
+    report("store (already loaded)", base, best_of(lambda: main.get_ff_df(ff_csv)))
+
+
+def bench_models(srcdir=main.SRCDIR, tickers_pth=main.TICKERS, n_events=5000):
+    """ Times `mk_model_aret_df` on random events (250-day estimation
+    windows), and the batched regressions against one `lstsq` per event
+
+    """
+    tickers = [tic.lower() for tic in main.get_tics(tickers_pth)]
+    prc_df = main.mk_prc_df(tickers, srcdir, main.SRC_COLS, main.SRC_COL_DTYPES,
+                            main.SRC_COL_WIDTHS, cache_dir=main.CACHEDIR)
+    rng = np.random.default_rng(0)
+    event_df = pd.DataFrame({
+        'tic': rng.choice(tickers, n_events),
+        'event_date': (pd.Timestamp('2012-01-01')
+                       + pd.to_timedelta(rng.integers(0, 3000, n_events), unit='D')),
+    })
+    print("\nfactor model abnormal returns: {} events".format(n_events))
+    for model, (factors, _) in main.AR_MODELS.items():
+        y = rng.standard_normal((n_events, 240))
+        X = np.concatenate([np.ones((n_events, 240, 1)),
+                            rng.standard_normal((n_events, 240, len(factors)))], axis=2)
+        base = best_of(lambda: batch_ols_loop(y, X), repeat=1)
+        report("{}: regressions only".format(model), base, best_of(lambda: main.batch_ols(y, X)))
+        new = best_of(lambda: main.mk_model_aret_df(prc_df, event_df, model), repeat=3)
+        report("{}: mk_model_aret_df".format(model), new, new)
+
+
+def bench_rec(srcdir=main.SRCDIR, n_copies=(1, 1000)):
+    """ Compares `read_rec_csv` against a naive reader on aapl_rec.csv and on
+    copies of its rows (800k+ rows)
+
+    """
+    print("\nread_rec_csv: naive reader vs typed reader")
+    with open(os.path.join(srcdir, 'aapl_rec.csv')) as fobj:
+        header, *rows = fobj.read().rstrip('\n').split('\n')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n in n_copies:
+            with open(os.path.join(tmpdir, 'big_rec.csv'), 'w') as fobj:
+                fobj.write('\n'.join([header] + rows * n) + '\n')
+            pth = os.path.join(tmpdir, 'big_rec.csv')
+            old_srcdir, main.SRCDIR = main.SRCDIR, tmpdir
+            try:
+                base = best_of(lambda: read_rec_csv_naive(pth), repeat=3)
+                new = best_of(lambda: main.read_rec_csv('big'), repeat=3)
+            finally:
+                main.SRCDIR = old_srcdir
+            report("{} rows".format(len(rows) * n), base, new)
+
+
+def bench_events(tickers_pth=main.TICKERS, n_copies=50):
+    """ Compares the event pipeline (`proc_rec_df` + `mk_event_df`) on
+    object strings against the shared categorical codes, on the
+    recommendations of every ticker repeated `n_copies` times, and the
+    memory of the 5x expanded event frame
+
+    """
+    tickers = sorted(set(tic.lower() for tic in main.get_tics(tickers_pth)))
+    rec_df = pd.concat([main.read_rec_csv(tic) for tic in tickers] * n_copies)
+    print("\nevent pipeline: object strings vs shared codes ({} recs)".format(len(rec_df)))
+    base = best_of(lambda: mk_events_str(rec_df), repeat=3)
+    new = best_of(lambda: main.mk_event_df(main.proc_rec_df(rec_df)), repeat=3)
+    report("proc_rec_df + mk_event_df", base, new)
+
+    # Memory of the event frame expanded 5 times (as in mk_ret_dates)
+    mem = []
+    for event_df in [mk_events_str(rec_df), main.mk_event_df(main.proc_rec_df(rec_df))]:
+        expanded = event_df.iloc[np.repeat(np.arange(len(event_df)), 5)]
+        mem.append(expanded.memory_usage(deep=True).sum() / 2**20)
+    print("{:<40s} {:>10.1f} MB {:>10.1f} MB".format('5x expanded events', *mem))
+
+
+def bench_top_n(tickers_pth=main.TICKERS, n_copies=20):
+    """ Compares selecting the top 30 firms with a full sort of the counts
+    (one `proc_rec_df` call per ticker) against the partial selection in one
+    grouped `proc_rec_df` call, on every ticker repeated `n_copies` times
+    (as separate tickers)
+
+    """
+    tickers = sorted(set(tic.lower() for tic in main.get_tics(tickers_pth)))
+    recs = {tic: main.read_rec_csv(tic) for tic in tickers}
+    rec_df = pd.concat([recs[tic].assign(tic='{}{}'.format(tic, i))
+                        for i in range(n_copies) for tic in tickers])
+    print("\ntop 30 firms: {} tickers".format(len(tickers) * n_copies))
+
+    def full_sort(df):
+        counts = df.groupby('firm', observed=True).size().reset_index(name='n')
+        top = counts.sort_values(['n', 'firm'], ascending=[False, True]).firm.iloc[:30]
+        return df.loc[df.firm.isin(top)]
+
+    base = best_of(lambda: [full_sort(df) for _, df in rec_df.groupby('tic')], repeat=3)
+    new = best_of(lambda: main.proc_rec_df(rec_df, by='tic'), repeat=3)
+    report("per ticker sort vs grouped partial", base, new)
+
+
+def bench_ret_dates(tickers_pth=main.TICKERS):
+    """ Compares building the event windows one event at a time against
+    the vectorized `mk_ret_dates`, for the events of every ticker
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    event_dfs = [main.mk_event_df(main.proc_rec_df(main.read_rec_csv(tic)))
+                 for tic in tickers]
+    print("\nmk_ret_dates: per event vs vectorized")
+    base = best_of(lambda: [mk_ret_dates_loop(df) for df in event_dfs], repeat=3)
+    new = best_of(lambda: [main.mk_ret_dates(df) for df in event_dfs], repeat=3)
+    report("{} events".format(sum(len(df) for df in event_dfs)), base, new)
+
+
+def bench_calendar(srcdir=main.SRCDIR, tickers_pth=main.TICKERS):
+    """ Compares joining abnormal returns on calendar dates against reading
+    them by trading-day position, for the events of every ticker
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    prc_df = main.mk_prc_df(tickers, srcdir, main.SRC_COLS, main.SRC_COL_DTYPES,
+                            main.SRC_COL_WIDTHS)
+    aret_df = main.mk_aret_df(prc_df)
+    event_dfs = [main.mk_event_df(main.proc_rec_df(main.read_rec_csv(tic)))
+                 for tic in tickers]
+    pairs = list(zip(event_dfs, tickers))
+    print("\nCAR windows: join on ret_date vs trading-day positions")
+    base = best_of(lambda: [cars_join(df, tic, aret_df) for df, tic in pairs], repeat=3)
+    new = best_of(lambda: [cars_pos(df, tic, aret_df) for df, tic in pairs], repeat=3)
+    report("{} events".format(sum(len(df) for df in event_dfs)), base, new)
+
+
+def bench_car_index(srcdir=main.SRCDIR, tickers_pth=main.TICKERS):
+    """ Compares summing abnormal returns over the expanded trading-day
+    windows against differences of the cumulative sums in `mk_car_index`
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    prc_df = main.mk_prc_df(tickers, srcdir, main.SRC_COLS, main.SRC_COL_DTYPES,
+                            main.SRC_COL_WIDTHS)
+    aret_df = main.mk_aret_df(prc_df)
+    event_dfs = [main.mk_event_df(main.proc_rec_df(main.read_rec_csv(tic)))
+                 for tic in tickers]
+    pairs = list(zip(event_dfs, range(len(tickers)), tickers))
+
+    def by_index():
+        car_index = main.mk_car_index(aret_df)
+        return [main.window_cars(car_index[:, col], aret_df.index, df['event_day'].values)
+                for df, col, _ in pairs]
+
+    print("\nCARs: expand + groupby vs cumulative sums")
+    base = best_of(lambda: [cars_pos(df, tic, aret_df) for df, _, tic in pairs], repeat=3)
+    new = best_of(by_index, repeat=3)
+    report("{} events".format(sum(len(df) for df in event_dfs)), base, new)
+
+
+def bench_windows(srcdir=main.SRCDIR, tickers_pth=main.TICKERS,
+                  windows=((-1, 1), (-2, 2), (0, 5), (-10, 10))):
+    """ Compares running `mk_cars` once per window against one run with all
+    the windows
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    prc_df = main.mk_prc_df(tickers, srcdir, main.SRC_COLS, main.SRC_COL_DTYPES,
+                            main.SRC_COL_WIDTHS)
+    aret_df = main.mk_aret_df(prc_df)
+    car_index = main.mk_car_index(aret_df)
+    print("\nCARs for {} windows: one run per window vs one pass".format(len(windows)))
+    base = best_of(lambda: [main.mk_cars(tic, aret_df, [w], car_index)
+                            for w in windows for tic in tickers], repeat=3)
+    new = best_of(lambda: [main.mk_cars(tic, aret_df, windows, car_index)
+                           for tic in tickers], repeat=3)
+    report("{} tickers".format(len(tickers)), base, new)
+
+
+def bench_car_workers(srcdir=main.SRCDIR, tickers_pth=main.TICKERS,
+                      workers=(1, 2, 4, 8)):
+    """ Times `mk_all_cars` with different numbers of worker processes, for
+    the tickers in TICKERS.txt and for a 500 ticker universe (the same
+    files under new tickers)
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    prc_df = main.mk_prc_df(tickers, srcdir, main.SRC_COLS, main.SRC_COL_DTYPES,
+                            main.SRC_COL_WIDTHS)
+    aret_df = main.mk_aret_df(prc_df)
+    print("\nmk_all_cars: scaling with workers ({} CPUs)".format(os.cpu_count()))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        universe, big_df = mk_rec_universe(srcdir, tickers, aret_df, tmpdir)
+
+        old_srcdir, main.SRCDIR = main.SRCDIR, tmpdir
+        try:
+            for tics, df in [(universe[:len(tickers)], big_df.iloc[:, :len(tickers)]),
+                             (universe, big_df)]:
+                base = None
+                for n in workers:
+                    new = best_of(lambda: main.mk_all_cars(tics, df, workers=n), repeat=3)
+                    base = base or new
+                    report("{} tickers, {} workers".format(len(tics), n), base, new)
+        finally:
+            main.SRCDIR = old_srcdir
+
+
+def bench_universe(srcdir=main.SRCDIR, tickers_pth=main.TICKERS):
+    """ Compares `mk_all_cars` (one ticker at a time) against
+    `mk_universe_cars` (all tickers together), for the tickers in
+    TICKERS.txt and for a 500 ticker universe (the same files under new
+    tickers)
+
+    """
+    tickers = main.get_tics(tickers_pth)
+    prc_df = main.mk_prc_df(tickers, srcdir, main.SRC_COLS, main.SRC_COL_DTYPES,
+                            main.SRC_COL_WIDTHS)
+    aret_df = main.mk_aret_df(prc_df)
+    print("\nCARs: per ticker vs whole universe")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        universe, big_df = mk_rec_universe(srcdir, tickers, aret_df, tmpdir)
+
+        old_srcdir, main.SRCDIR = main.SRCDIR, tmpdir
+        try:
+            for tics, df in [(universe[:len(tickers)], big_df.iloc[:, :len(tickers)]),
+                             (universe, big_df)]:
+                base = best_of(lambda: main.mk_all_cars(tics, df), repeat=3)
+                new = best_of(lambda: main.mk_universe_cars(tics, df), repeat=3)
+                report("{} tickers".format(len(tics)), base, new)
+        finally:
+            main.SRCDIR = old_srcdir
+
+
+def bench_stream(n_rows=1000000, chunk_rows=65536):
+    """ Compares the peak memory and time of computing the returns of a large
+    synthetic DAT file with `dat_to_df` against the chunked reader
+
+    """
+    args = (main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    rng = np.random.default_rng(0)
+    dates = np.datetime64('1900-01-01') + np.arange(n_rows)
+    prices = 50 * np.exp(np.cumsum(rng.normal(0, 0.01, n_rows)))
+
+    def whole(pth):
+        prices = main.dat_to_df(pth, *args, usecols=['adjClose'])['adjClose'].values
+        return np.nansum(prices[1:] / prices[:-1] - 1)
+
+    def chunked(pth):
+        chunks = main.iter_dat_chunks(pth, ['date', 'adjClose'], *args, chunk_rows)
+        return sum(np.nansum(rets) for _, rets in main.iter_chunk_rets(chunks))
+
+    def adj_close(pth, chunk_rows=None):
+        return main.read_adj_close('big', os.path.dirname(pth), *args, chunk_rows=chunk_rows)
+
+    print("\nreturns of a {} row DAT file: whole file vs {} row chunks".format(
+        n_rows, chunk_rows))
+    print("{:<40s} {:>13s} {:>13s}".format('', 'time', 'peak'))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pth = os.path.join(tmpdir, 'big_prc.dat')
+        write_synth_dat(pth, dates, prices, rng)
+        for name, func in [('dat_to_df', whole), ('iter_dat_chunks', chunked),
+                           ('read_adj_close', adj_close),
+                           ('read_adj_close, chunk_rows',
+                            lambda pth: adj_close(pth, chunk_rows))]:
+            secs = best_of(lambda: func(pth), repeat=3)
+            tracemalloc.start()
+            func(pth)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("{:<40s} {:>10.1f} ms {:>10.1f} MB".format(name, secs * 1e3, peak / 2**20))
+
+
+def bench_dates(srcdir=main.SRCDIR):
+    """ Compares decoding the date field of every DAT file with the generic
+    parsers (pandas on strings, NumPy on bytes) against the arithmetic
+    decoder `fw_dates_to_days`
+
+    """
+    pths = sorted(glob.glob(os.path.join(srcdir, '*_prc.dat')))
+    views = [main.dat_col_views(p, main.SRC_COLS, main.SRC_COL_WIDTHS)['date'] for p in pths]
+    strs = [np.ascontiguousarray(v).view('S11').ravel().astype(str) for v in views]
+    print("\ndate field of {} DAT files ({} rows)".format(len(pths), sum(len(s) for s in strs)))
+    base = best_of(lambda: [pd.DatetimeIndex(s) for s in strs], repeat=3)
+    new = best_of(lambda: [main.fw_dates_to_days(v) for v in views], repeat=3)
+    report("pandas parser vs arithmetic", base, new)
+    base = best_of(lambda: [np.ascontiguousarray(v).view('S11').ravel().astype('datetime64[D]')
+                            for v in views], repeat=3)
+    report("numpy astype vs arithmetic", base, new)
+
+
+def bench_sorted(srcdir=main.SRCDIR):
+    """ Compares sorting every parsed DAT file by date against checking
+    that it is already in date order (see `sort_by_date`)
+
+    """
+    args = (main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    pths = sorted(glob.glob(os.path.join(srcdir, '*_prc.dat')))
+    parsed = [main.parse_dat_cols(p, main.SRC_COLS, *args) for p in pths]
+
+    def sort_index():
+        for data in parsed:
+            data = dict(data)
+            df = pd.DataFrame(data, index=pd.DatetimeIndex(data.pop('date')))
+            df.sort_index(inplace=True)
+
+    def check_order():
+        for pth, data in zip(pths, parsed):
+            data = dict(data)
+            dates, data = main.sort_by_date(pth, data.pop('date'), data)
+            pd.DataFrame(data, index=pd.DatetimeIndex(dates))
+
+    print("\ndate order of {} DAT files: sort_index vs check".format(len(pths)))
+    base = best_of(sort_index, repeat=5)
+    new = best_of(check_order, repeat=5)
+    report("all {} files".format(len(pths)), base, new)
+
+
+def bench_memory(srcdir=main.SRCDIR):
+    """ Reports the memory held by the parsed DataFrames for every DAT file in
+    `srcdir`, and the peak memory allocated while parsing them, for the
+    string-based row loop and for the typed parser.
+
+    """
+    args = (main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    pths = sorted(glob.glob(os.path.join(srcdir, '*_prc.dat')))
+    print("\nmemory for all {} DAT files".format(len(pths)))
+    print("{:<40s} {:>13s} {:>13s}".format('', 'held', 'peak'))
+    for name, func in [('row loop (str cells)', dat_to_df_loop),
+                       ('typed parser', main.dat_to_df),
+                       ('typed parser (mmap)', functools.partial(main.dat_to_df, use_mmap=True))]:
+        tracemalloc.start()
+        dfs = [func(p, *args) for p in pths]
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        held = sum(df.memory_usage(deep=True).sum() + df.index.memory_usage(deep=True)
+                   for df in dfs)
+        print("{:<40s} {:>10.1f} MB {:>10.1f} MB".format(name, held / 2**20, peak / 2**20))
+
+
+# ----------------------------------------------------------------------------
+#   Benchmark suite on synthetic data
+# ----------------------------------------------------------------------------
+def run_suite(n_tickers=50, n_years=10, n_recs=300, seed=0, repeat=3):
+    """ Creates a synthetic data set (see `mk_synth_data`) and times every
+    stage of the pipeline on it, from `dat_to_df` to the CARs by event
+    type.
+
+    Returns
+    -------
+    dict
+        The best time (in seconds) of `repeat` runs of each stage
+
+    """
+    args = (main.SRC_COLS, main.SRC_COL_DTYPES, main.SRC_COL_WIDTHS)
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        tickers_pth, srcdir, ff_csv = mk_synth_data(root, n_tickers, n_years, n_recs, seed)
+        cache_dir = os.path.join(root, 'cache')
+        old = main.SRCDIR, main.FF_CSV, main.CACHEDIR
+        main.SRCDIR, main.FF_CSV, main.CACHEDIR = srcdir, ff_csv, cache_dir
+        try:
+            def timed(name, func):
+                results[name] = best_of(func, repeat=repeat)
+                return func()
+
+            tickers = timed('get_tics', lambda: main.get_tics(tickers_pth))
+            pths = [os.path.join(srcdir, tic + '_prc.dat') for tic in tickers]
+            timed('dat_to_df', lambda: [main.dat_to_df(p, *args) for p in pths])
+            timed('mk_prc_df', lambda: main.mk_prc_df(tickers, srcdir, *args))
+            # Fill the cache first, so only warm reads are timed
+            main.mk_prc_df(tickers, srcdir, *args, cache_dir=cache_dir)
+            prc_df = timed('mk_prc_df (cached)', lambda: main.mk_prc_df(
+                tickers, srcdir, *args, cache_dir=cache_dir))
+            aret_df = timed('mk_aret_df', lambda: main.mk_aret_df(prc_df))
+            rec_df = timed('read_rec_csvs', lambda: main.read_rec_csvs(tickers))
+            rec_df = timed('proc_rec_df', lambda: main.proc_rec_df(rec_df, by='tic'))
+            timed('mk_event_df', lambda: main.mk_event_df(rec_df, by='tic'))
+            timed('mk_all_cars', lambda: main.mk_all_cars(tickers, aret_df))
+            cars = timed('mk_universe_cars', lambda: main.mk_universe_cars(tickers, aret_df))
+            timed('cars_by_etype', lambda: cars.groupby(
+                ['window', 'event_type'], observed=True)[['car']].mean())
+        finally:
+            main.SRCDIR, main.FF_CSV, main.CACHEDIR = old
+    return results
+
+
+def compare_results(results, baseline, threshold=0.2):
+    """ Prints the times in `results` against those in `baseline` (both as
+    returned by `run_suite`) and returns the stages which are more than
+    `threshold` (a fraction) slower than in `baseline`
+
+    """
+    regressions = []
+    print("{:<40s} {:>13s} {:>13s} {:>9s}".format('stage', 'baseline', 'now', ''))
+    for name, new in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print("{:<40s} {:>13s} {:>10.2f} ms".format(name, '', new * 1e3))
+            continue
+        slower = new > base * (1 + threshold)
+        if slower:
+            regressions.append(name)
+        print("{:<40s} {:>10.2f} ms {:>10.2f} ms {:>8.2f}x{}".format(
+            name, base * 1e3, new * 1e3, base / new, '  REGRESSION' if slower else ''))
+    return regressions
+
+
+def main_suite(argv=None):
+    """ Runs `run_suite` from the command line, e.g.
+
+        python bench.py suite --tickers 500 --years 20 --recs 500
+        python bench.py suite --save baseline.json
+        python bench.py suite --baseline baseline.json --threshold 0.1
+
+    Returns 1 if a stage is slower than in the baseline, 0 otherwise.
+
+    """
+    parser = argparse.ArgumentParser(prog='bench.py suite')
+    parser.add_argument('--tickers', type=int, default=50)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--recs', type=int, default=300, help='recommendations per ticker')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='flag stages slower than the baseline by this fraction')
+    opts = parser.parse_args(argv)
+
+    config = {'tickers': opts.tickers, 'years': opts.years, 'recs': opts.recs,
+              'seed': opts.seed}
+    print("suite: {}".format(config))
+    results = run_suite(opts.tickers, opts.years, opts.recs, opts.seed, opts.repeat)
+    baseline = {}
+    if opts.baseline:
+        with open(opts.baseline) as fobj:
+            saved = json.load(fobj)
+        if saved['config'] != config:
+            print("warning: the baseline was run with {}".format(saved['config']))
+        baseline = saved['results']
+    regressions = compare_results(results, baseline, opts.threshold)
+    if opts.save:
+        with open(opts.save, 'w') as fobj:
+            json.dump({'config': config, 'results': results}, fobj, indent=2)
+    if regressions:
+        print("{} stage(s) slower than the baseline: {}".format(
+            len(regressions), ', '.join(regressions)))
+        return 1
+    return 0
+
+
+def main_bench():
+    """ Runs every benchmark in this module
+
+    """
+    bench_dat_to_df()
+    bench_usecols()
+    bench_workers()
+    bench_cache()
+    bench_panel()
+    bench_incremental()
+    bench_aret()
+    bench_ff()
+    bench_models()
+    bench_rec()
+    bench_events()
+    bench_top_n()
+    bench_ret_dates()
+    bench_calendar()
+    bench_car_index()
+    bench_windows()
+    bench_car_workers()
+    bench_universe()
+    bench_stream()
+    bench_dates()
+    bench_sorted()
+    bench_memory()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['suite']:
+        sys.exit(main_suite(sys.argv[2:]))
+    main_bench()
@@ -3,11 +3,27 @@
 Complete the sections below marked with '<COMPLETE THIS PART>'
 
 """
+import contextlib
 import datetime as dt
+import functools
+import hashlib
+import json
+import os
 import os.path
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import as_strided
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 # SRCDIR is the folder containing all the data:
 # - `<tic>_prc.dat`
@@ -22,6 +38,30 @@ TICKERS = "TICKERS.txt"
 # FF_CSV is the location of the ff_daily.csv  file
 FF_CSV = 'data/ff_daily.csv'
 
+# CACHEDIR is the folder with the binary copies of the parsed source files
+# (set it to None to always parse the source files)
+CACHEDIR = "cache"
+
+# CAR_WINDOWS are the event windows (first and last trading day, relative to
+# the first trading day on or after the event day) of the CARs
+CAR_WINDOWS = [(-2, 2)]
+
+# BATCHED is True to compute the CARs of all the tickers together (see
+# `mk_universe_cars`), and False to compute them one ticker at a time (in
+# WORKERS processes)
+BATCHED = True
+
+# PROFILE is True to record the time, memory and rows of each stage of
+# `main` (set the environment variable MAIN_PROFILE=1 to turn it on), and
+# PROFILE_JSON is where the report is written
+PROFILE = os.environ.get('MAIN_PROFILE', '0') not in ('', '0')
+PROFILE_JSON = 'profile.json'
+
+# WORKERS is the number of processes used to load the price files and to
+# compute the CARs (1 means process the tickers one after another in this
+# process)
+WORKERS = 1
+
 # ----------------------------------------------------------------------------
 #   Modify these variables as specified by the README.txt file
 # ----------------------------------------------------------------------------
@@ -63,6 +103,131 @@ SRC_COL_WIDTHS = {
 }
 
 
+# ----------------------------------------------------------------------------
+#   Stage profiling
+# ----------------------------------------------------------------------------
+# STAGE_STATS holds one dict per stage run while PROFILE is True
+STAGE_STATS = []
+
+# Returned by `stage` while PROFILE is False
+NO_STAGE = contextlib.nullcontext({})
+
+
+def peak_rss_mb():
+    """ Returns the peak resident memory of this process so far, in MB (None
+    if it is not available)
+
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / 2**20
+    return maxrss / 1024
+
+
+@contextlib.contextmanager
+def timed_stage(name, rows_in, tic, records=STAGE_STATS):
+    """ Context manager used by `stage` while PROFILE is True, which appends
+    the statistics of the stage to the list `records`
+
+    """
+    stats = {'stage': name, 'tic': tic, 'rows_in': rows_in, 'rows_out': None}
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield stats
+    finally:
+        stats['wall_s'] = time.perf_counter() - wall
+        stats['cpu_s'] = time.process_time() - cpu
+        stats['peak_rss_mb'] = peak_rss_mb()
+        records.append(stats)
+
+
+def stage(name, rows_in=None, tic=None):
+    """ Returns a context manager recording the wall time, CPU time and peak
+    RSS of the code it wraps into `STAGE_STATS`, if PROFILE is True. It
+    yields a dict in which the code can set 'rows_out'.
+
+    While PROFILE is False, nothing is recorded (the context manager does
+    nothing).
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+
+    rows_in : int, optional
+        Number of rows going into the stage
+
+    tic : str, optional
+        Ticker, for the stages run once per ticker
+
+    """
+    if not PROFILE:
+        return NO_STAGE
+    return timed_stage(name, rows_in, tic)
+
+
+def run_stage(name, func, tic):
+    """ Returns `func(tic)` and a list with the statistics of this call as
+    the stage `name` of the ticker `tic` (see `stage`).
+
+    Used in worker processes, whose `STAGE_STATS` the main process does not
+    see: the statistics are sent back with the result (see `map_stages`).
+    Their 'peak_rss_mb' is the peak RSS of the worker.
+
+    """
+    records = []
+    with timed_stage(name, None, tic, records) as stats:
+        result = func(tic)
+        stats['rows_out'] = len(result)
+    return result, records
+
+
+def map_stages(executor, name, func, tickers, chunksize=1):
+    """ Returns `[func(tic) for tic in tickers]`, computed by `executor`. If
+    PROFILE is True, each call is recorded in `STAGE_STATS` as the stage
+    `name` of its ticker (see `run_stage`).
+
+    """
+    if not PROFILE:
+        # executor.map returns the results in the order of `tickers`
+        return list(executor.map(func, tickers, chunksize=chunksize))
+    results = list(executor.map(functools.partial(run_stage, name, func), tickers,
+                                chunksize=chunksize))
+    for _, records in results:
+        STAGE_STATS.extend(records)
+    return [result for result, _ in results]
+
+
+def profile_table(stats):
+    """ Returns the stage statistics `stats` (see `STAGE_STATS`) as a text
+    table
+
+    """
+    fmt = "{:<20s} {:<8s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}"
+    lines = [fmt.format('stage', 'tic', 'wall ms', 'cpu ms', 'rss MB',
+                        'rows in', 'rows out')]
+    for s in stats:
+        lines.append(fmt.format(
+            s['stage'], s['tic'] or '',
+            '{:.1f}'.format(s['wall_s'] * 1e3), '{:.1f}'.format(s['cpu_s'] * 1e3),
+            '' if s['peak_rss_mb'] is None else '{:.0f}'.format(s['peak_rss_mb']),
+            '' if s['rows_in'] is None else str(s['rows_in']),
+            '' if s['rows_out'] is None else str(s['rows_out'])))
+    return "\n".join(lines)
+
+
+def write_profile(pth, stats):
+    """ Writes the stage statistics `stats` (see `STAGE_STATS`) to the JSON
+    file `pth`
+
+    """
+    with open(pth, 'w') as fobj:
+        json.dump({'stages': stats}, fobj, indent=2)
+
+
 # ----------------------------------------------------------------------------
 #   Function get_tics
 # ----------------------------------------------------------------------------
@@ -88,8 +253,559 @@ def get_tics(pth):
         - All characters are in lower case
         - There are no spaces
         - The list contains no empty/blank tickers
+        - The list contains each ticker once, in the order of its first
+          appearance in the file (a ticker listed twice, like INTC in
+          TICKERS.txt, would give two identical columns in `mk_prc_df`)
     """
-    return (open(pth).read().strip().split("\n"))
+    tickers = [tic.strip().lower().replace(' ', '') for tic in open(pth).read().split("\n")]
+    # Keep the first occurrence of each ticker
+    return list(dict.fromkeys(tic for tic in tickers if tic))
+
+
+# ----------------------------------------------------------------------------
+#   Fixed-width helpers used by dat_to_df
+# ----------------------------------------------------------------------------
+def mk_col_offsets(src_cols, src_col_widths):
+    """ Returns a dict mapping each column in `src_cols` to the (start, stop)
+    byte offsets of that column inside a row of the DAT file.
+
+    """
+    offsets = {}
+    start = 0
+    for col in src_cols:
+        stop = start + src_col_widths[col]
+        offsets[col] = (start, stop)
+        start = stop
+    return offsets
+
+
+def read_dat_rows(pth, row_width, use_mmap=False, start=0, stop=None):
+    """ Returns a 2-D uint8 array with one row per line of the DAT file at
+    `pth` and `row_width` columns (the line terminator is dropped).
+
+    Only the lines in the bytes from `start` to `stop` (by default, the end
+    of the file) are read. `start` must be the beginning of a line or the
+    line terminator just before it.
+
+    If `use_mmap` is True, the file is memory-mapped instead of read, and the
+    array is a read-only strided view over the mapped bytes. Nothing is
+    copied until a column is converted.
+
+    """
+    if stop is None:
+        stop = os.path.getsize(pth)
+    if use_mmap:
+        if stop <= start:
+            return np.empty((0, row_width), dtype=np.uint8)
+        raw = np.memmap(pth, dtype=np.uint8, mode='r', offset=start, shape=(stop - start,))
+    else:
+        with open(pth, 'rb') as fobj:
+            fobj.seek(start)
+            raw = np.frombuffer(fobj.read(stop - start), dtype=np.uint8)
+
+    # Skip the line terminator of the previous line (when reading from an
+    # offset) and the one at the end of the file
+    first = 0
+    while first < len(raw) and int(raw[first]) in b'\r\n':
+        first += 1
+    last = len(raw)
+    while last > first and int(raw[last - 1]) in b'\r\n':
+        last -= 1
+    raw = raw[first:last]
+    if not len(raw):
+        return np.empty((0, row_width), dtype=np.uint8)
+
+    # Every line has the same length, so the line stride (including '\n' or
+    # '\r\n') is found from the first line only
+    newlines = np.flatnonzero(raw[:row_width + 2] == ord('\n'))
+    stride = newlines[0] + 1 if len(newlines) else len(raw) + 1
+
+    # The last line no longer has its line terminator
+    n_rows = (len(raw) + stride - row_width) // stride
+    return as_strided(raw, shape=(n_rows, row_width), strides=(stride, 1),
+                      writeable=False)
+
+
+def dat_col_views(pth, src_cols, src_col_widths, use_mmap=False, start=0, stop=None):
+    """ Returns a dict mapping each column in `src_cols` to a 2-D uint8 view
+    (one row per line) of its fixed-width bytes in the DAT file at `pth`
+    (between the bytes `start` and `stop`, see `read_dat_rows`).
+
+    The views are not converted, so callers only pay for the columns they
+    actually use (see `fw_col_to_array`).
+
+    """
+    col_offsets = mk_col_offsets(src_cols, src_col_widths)
+    row_width = sum(src_col_widths[c] for c in src_cols)
+    dat_rows = read_dat_rows(pth, row_width, use_mmap, start, stop)
+    return {col: dat_rows[:, a:b] for col, (a, b) in col_offsets.items()}
+
+
+def mk_digit_pairs():
+    """ Returns a lookup table mapping two ASCII bytes, read as a native
+    uint16, to the number 0-99 they spell (-1 if they are not two digits)
+
+    """
+    digits = np.arange(10)
+    first, second = ord('0') + digits[:, np.newaxis], ord('0') + digits[np.newaxis, :]
+    if np.little_endian:
+        keys = first | (second << 8)
+    else:
+        keys = (first << 8) | second
+    pairs = np.full(1 << 16, -1, dtype=np.int16)
+    pairs[keys.ravel()] = (10 * digits[:, np.newaxis] + digits[np.newaxis, :]).ravel()
+    return pairs
+
+
+# DIGIT_PAIRS is the lookup table used to decode dates (see `mk_digit_pairs`)
+DIGIT_PAIRS = mk_digit_pairs()
+
+
+def pair_values(col_bytes, pos):
+    """ Returns the numbers spelled by the two bytes at `pos` of each row of
+    `col_bytes` (see `mk_digit_pairs`)
+
+    """
+    return DIGIT_PAIRS[col_bytes[:, pos:pos + 2].view(np.uint16).ravel()]
+
+
+def fw_dates_to_days(col_bytes):
+    """ Converts a 2-D uint8 array holding one date per row, as YYYY-MM-DD in
+    the last 10 bytes and spaces before, into a datetime64[D] array.
+
+    Dates in DAT files come in runs of the same month, so the year and month
+    are only decoded at the first row of each run, and only the day is
+    decoded for every row (with `DIGIT_PAIRS`). Returns None if any row is
+    not a valid date in this layout.
+
+    """
+    n_rows, width = col_bytes.shape
+    if width < 10 or not (col_bytes[:, :width - 10] == ord(' ')).all():
+        return None
+    ymd = col_bytes[:, width - 10:]
+    if not n_rows:
+        return np.empty(0, dtype='datetime64[D]')
+
+    # First row of each run of rows with the same 'YYYY-MM-' bytes
+    year_month = ymd[:, :8].view(np.uint64).ravel()
+    first = np.flatnonzero(np.concatenate([[True], year_month[1:] != year_month[:-1]]))
+    runs = ymd[first]
+    century, year, month = pair_values(runs, 0), pair_values(runs, 2), pair_values(runs, 5)
+    if not ((century >= 0).all() and (year >= 0).all() and (runs[:, [4, 7]] == ord('-')).all()
+            and ((month >= 1) & (month <= 12)).all()):
+        return None
+    months = ((100 * century.astype(np.int64) + year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    month_start = months.astype('datetime64[D]').astype(np.int64)
+    month_days = (months + 1).astype('datetime64[D]').astype(np.int64) - month_start
+
+    # Day of each row, checked against the length of its month
+    run_len = np.diff(np.append(first, n_rows))
+    day = pair_values(ymd, 8).astype(np.int64)
+    if not ((day >= 1) & (day <= np.repeat(month_days, run_len))).all():
+        return None
+    return (np.repeat(month_start, run_len) + day - 1).astype('datetime64[D]')
+
+
+def fw_col_to_array(col_bytes, dtype):
+    """ Converts a 2-D uint8 array holding one fixed-width field per row into
+    a 1-D array of type `dtype` (as it appears in `SRC_COL_DTYPES`).
+
+    Numbers and dates are converted straight from the bytes, without
+    creating one Python string per cell.
+
+    """
+    width = col_bytes.shape[1]
+    if dtype.startswith('datetime64'):
+        # Decode the usual ' YYYY-MM-DD' fields directly from the bytes, and
+        # let NumPy parse anything else (it ignores the padding, and raises
+        # on invalid dates)
+        days = fw_dates_to_days(col_bytes)
+        if days is None:
+            fields = np.ascontiguousarray(col_bytes).view('S{}'.format(width)).ravel()
+            days = fields.astype('datetime64[D]')
+        return days.astype('datetime64[ns]')
+    fields = np.ascontiguousarray(col_bytes).view('S{}'.format(width)).ravel()
+    return fields.astype(dtype)
+
+
+def parse_dat_cols(pth, cols, src_cols, src_col_dtypes, src_col_widths,
+                   use_mmap=False, start=0, stop=None):
+    """ Returns a dict mapping each column in `cols` to an array (of the
+    dtype in `src_col_dtypes`) with the values of that column in the DAT
+    file at `pth`, between the bytes `start` and `stop` (see
+    `read_dat_rows`).
+
+    """
+    col_views = dat_col_views(pth, src_cols, src_col_widths, use_mmap, start, stop)
+    return {col: fw_col_to_array(col_views[col], src_col_dtypes[col]) for col in cols}
+
+
+def dat_line_stride(pth, row_width):
+    """ Returns the number of bytes of each line of the DAT file at `pth`,
+    including the line terminator ('\n' or '\r\n')
+
+    """
+    with open(pth, 'rb') as fobj:
+        head = fobj.read(row_width + 2)
+    return row_width + (2 if head[row_width:] == b'\r\n' else 1)
+
+
+def iter_dat_chunks(pth, cols, src_cols, src_col_dtypes, src_col_widths,
+                    chunk_rows=65536):
+    """ Yields the columns `cols` of the DAT file at `pth` in blocks of (at
+    most) `chunk_rows` lines, in file order, as dicts like the output of
+    `parse_dat_cols`.
+
+    The file is memory-mapped one block at a time, so only one block of
+    converted columns is held in memory, whatever the size of the file.
+
+    """
+    row_width = sum(src_col_widths[c] for c in src_cols)
+    size = os.path.getsize(pth)
+    if not size:
+        return
+    chunk_bytes = chunk_rows * dat_line_stride(pth, row_width)
+    for start in range(0, size, chunk_bytes):
+        yield parse_dat_cols(pth, cols, src_cols, src_col_dtypes, src_col_widths,
+                             True, start, min(start + chunk_bytes, size))
+
+
+def iter_chunk_rets(chunks, col='adjClose'):
+    """ Yields the dates and the returns of the column `col` for each block
+    in `chunks` (see `iter_dat_chunks`). The first return of a block uses
+    the last price of the previous block, so the returns are the same as
+    for the whole file at once (the first one is NaN).
+
+    """
+    last = np.nan
+    for chunk in chunks:
+        prices = chunk[col]
+        prev = np.empty_like(prices)
+        prev[:1] = last
+        prev[1:] = prices[:-1]
+        yield chunk['date'], prices / prev - 1
+        if len(prices):
+            last = prices[-1]
+
+
+# ----------------------------------------------------------------------------
+#   Binary cache of parsed source files
+# ----------------------------------------------------------------------------
+# Each source file has a cache entry: a folder in the cache folder with one
+# raw binary file ('<col>.bin') per column (so loading other columns of the
+# same file adds files to its entry, and rows appended to the source file are
+# appended to these files) and a 'meta.json' file with the fields:
+# - 'src': absolute path of the source file
+# - 'stamp': (size, mtime) of the source file when it was parsed
+# - 'layout': key of the columns, dtypes and widths used to parse it (see
+#   `layout_key`), so changing SRC_COL_WIDTHS or SRC_COL_DTYPES makes the
+#   entry stale
+# - 'tail': last bytes of a DAT file, used to check that it was only appended to
+# - 'cols': columns stored in the entry
+# - 'dtypes': dtype of each column in 'cols'
+# - 'rows': number of rows of every column (bytes after them in a column file
+#   were left by an interrupted append, and are ignored)
+# - 'ordered': True if the entry has a 'date' column in date order, so the
+#   rows after a date are found by binary search (see `rows_since`)
+CACHE_META = ('src', 'stamp', 'layout', 'tail', 'cols', 'dtypes', 'rows', 'ordered')
+
+
+def cache_pth(src_pth, cache_dir):
+    """ Returns the location of the cache entry (a folder) for the source
+    file `src_pth`
+
+    """
+    return os.path.join(cache_dir, os.path.basename(src_pth))
+
+
+def layout_key(src_cols, src_col_dtypes, src_col_widths):
+    """ Returns a string identifying the layout of a DAT file (the order,
+    dtypes and widths of its columns), stored in its cache entry
+
+    """
+    layout = [[col, src_col_dtypes[col], src_col_widths[col]] for col in src_cols]
+    return hashlib.sha1(json.dumps(layout).encode()).hexdigest()
+
+
+def src_stamp(src_pth):
+    """ Returns the (size, mtime) of the file `src_pth` as an int64 array. A
+    cache entry is only valid if it was built from a file with the same stamp.
+
+    """
+    stat = os.stat(src_pth)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def read_meta(src_pth, cache_dir):
+    """ Returns a dict with the fields in `CACHE_META` of the cache entry for
+    `src_pth` ('stamp' as an int64 array, 'tail' as a uint8 array, 'dtypes'
+    as a dict mapping each column in 'cols' to its dtype), or None if there
+    is no entry for this file.
+
+    """
+    pth = os.path.join(cache_pth(src_pth, cache_dir), 'meta.json')
+    if not os.path.exists(pth):
+        return None
+    with open(pth) as fobj:
+        meta = json.load(fobj)
+    if any(k not in meta for k in CACHE_META):
+        return None
+    if meta['src'] != os.path.abspath(src_pth):
+        return None
+    meta['stamp'] = np.array(meta['stamp'], dtype=np.int64)
+    meta['tail'] = np.frombuffer(bytes.fromhex(meta['tail']), dtype=np.uint8)
+    meta['dtypes'] = dict(zip(meta['cols'], meta['dtypes']))
+    return meta
+
+
+def read_cols(src_pth, cache_dir, cols, dtypes, rows, use_mmap=False):
+    """ Returns a dict mapping each column in `cols` to its array in the cache
+    entry for `src_pth`, where `dtypes` maps each column to its dtype and
+    every column has `rows` rows. If `use_mmap` is True, the arrays are
+    memory-mapped from the column files instead of being read into memory.
+
+    """
+    entry_pth = cache_pth(src_pth, cache_dir)
+    data = {}
+    for col in cols:
+        pth = os.path.join(entry_pth, col + '.bin')
+        if use_mmap and rows:
+            data[col] = np.memmap(pth, dtype=dtypes[col], mode='r', shape=(rows,))
+        else:
+            data[col] = np.fromfile(pth, dtype=dtypes[col], count=rows)
+    return data
+
+
+def read_cache(src_pth, cache_dir, cols=None, layout=''):
+    """ Returns a dict mapping column names to the arrays stored in the cache
+    entry for `src_pth`, or None if there is no valid entry (missing, built
+    from another version of the file or with another `layout`, or without
+    some column in `cols`).
+
+    If `cols` is None, all the columns in the entry are returned.
+
+    """
+    meta = read_meta(src_pth, cache_dir)
+    if meta is None or meta['layout'] != layout:
+        return None
+    if not np.array_equal(meta['stamp'], src_stamp(src_pth)):
+        return None
+    if cols is None:
+        cols = meta['cols']
+    if any(c not in meta['cols'] for c in cols):
+        return None
+    return read_cols(src_pth, cache_dir, cols, meta['dtypes'], meta['rows'])
+
+
+def save_atomic(pth, save):
+    """ Calls `save(fobj)` on a temporary file and then moves it to `pth`, so
+    readers never see a partial file
+
+    """
+    tmp_pth = pth + '.tmp'
+    with open(tmp_pth, 'wb') as fobj:
+        save(fobj)
+    os.replace(tmp_pth, pth)
+
+
+def write_cols(src_pth, cache_dir, data):
+    """ Stores the arrays in the dict `data` as columns of the cache entry for
+    `src_pth` (they are only used once listed by `write_meta`)
+
+    """
+    entry_pth = cache_pth(src_pth, cache_dir)
+    os.makedirs(entry_pth, exist_ok=True)
+    for col, values in data.items():
+        save_atomic(os.path.join(entry_pth, col + '.bin'), values.tofile)
+
+
+def append_cols(src_pth, cache_dir, data, rows):
+    """ Appends the arrays in the dict `data` to the columns of the cache
+    entry for `src_pth`, which have `rows` rows. Only the new rows are
+    written (they are only used once counted by `write_meta`).
+
+    """
+    entry_pth = cache_pth(src_pth, cache_dir)
+    for col, values in data.items():
+        with open(os.path.join(entry_pth, col + '.bin'), 'r+b') as fobj:
+            # Drop what an interrupted append may have left after the rows
+            fobj.truncate(rows * values.dtype.itemsize)
+            fobj.seek(0, os.SEEK_END)
+            values.tofile(fobj)
+
+
+def write_meta(src_pth, cache_dir, stamp, dtypes, rows, layout='', tail=None,
+               ordered=False):
+    """ Stores the fields of the cache entry for `src_pth` (see `CACHE_META`).
+    `stamp` is the `src_stamp` of the file taken before it was parsed, and
+    `dtypes` maps each column in the entry to its dtype.
+
+    """
+    entry_pth = cache_pth(src_pth, cache_dir)
+    os.makedirs(entry_pth, exist_ok=True)
+    if tail is None:
+        tail = np.empty(0, dtype=np.uint8)
+    meta = {'src': os.path.abspath(src_pth), 'stamp': [int(v) for v in stamp],
+            'layout': layout, 'tail': tail.tobytes().hex(), 'cols': list(dtypes),
+            'dtypes': list(dtypes.values()), 'rows': int(rows), 'ordered': bool(ordered)}
+    save_atomic(os.path.join(entry_pth, 'meta.json'),
+                lambda fobj: fobj.write(json.dumps(meta).encode()))
+
+
+def col_dtypes(data):
+    """ Returns a dict mapping each column in the dict `data` to the dtype of
+    its array, as stored in the 'dtypes' field of a cache entry
+
+    """
+    return {col: values.dtype.str for col, values in data.items()}
+
+
+def write_cache(src_pth, cache_dir, stamp, data, layout='', tail=None, ordered=False):
+    """ Stores the arrays in the dict `data` (all with the same length) as
+    the cache entry for `src_pth`, replacing the previous entry.
+
+    """
+    rows = len(next(iter(data.values()))) if data else 0
+    write_cols(src_pth, cache_dir, data)
+    write_meta(src_pth, cache_dir, stamp, col_dtypes(data), rows, layout, tail, ordered)
+
+
+def dates_ordered(dates):
+    """ Returns True if the datetime64 array `dates` is in date order
+
+    """
+    return not (np.diff(dates.view(np.int64)) < 0).any()
+
+
+def rows_since(data, since, ordered=False):
+    """ Returns the rows of the arrays in the dict `data` dated after
+    `since` (by its 'date' column), copied into memory.
+
+    If `ordered` is True, the dates are known to be in order, so the first
+    of these rows is found by binary search and only the rows after it are
+    read (the other rows of memory-mapped arrays are never touched).
+    Otherwise every date is compared with `since`.
+
+    """
+    since = pd.Timestamp(since).to_datetime64()
+    if ordered:
+        keep = slice(np.searchsorted(data['date'], since, side='right'), None)
+    else:
+        keep = data['date'] > since
+    return {col: np.array(values[keep]) for col, values in data.items()}
+
+
+def file_tail(pth, stop, size):
+    """ Returns the `size` bytes of the file at `pth` that end at byte
+    `stop`.
+
+    """
+    with open(pth, 'rb') as fobj:
+        fobj.seek(max(0, stop - size))
+        return fobj.read(min(stop, size))
+
+
+def mk_tail(pth, stop):
+    """ Returns the last bytes (up to 64) of the DAT file at `pth` before
+    byte `stop`, as stored in the 'tail' field of its cache entry.
+
+    """
+    return np.frombuffer(file_tail(pth, stop, 64), dtype=np.uint8)
+
+
+def load_dat_cols(pth, cols, src_cols, src_col_dtypes, src_col_widths,
+                  use_mmap=False, cache_dir=None, since=None):
+    """ Same as `parse_dat_cols`, but loads the columns from the cache entry
+    of the DAT file at `pth` in `cache_dir` when possible:
+
+    - If the file has not changed (and was cached with the same layout), the
+      cached columns are returned. Columns of `cols` not in the entry yet
+      are parsed and added to it, without touching the others.
+
+    - If rows were only appended to the file (it grew, and the bytes at the
+      end of the cached version are unchanged), only the new rows are parsed
+      and appended to the column files of the entry.
+
+    - Otherwise the whole file is parsed and the cache entry is rebuilt.
+
+    If `use_mmap` is True, the cached columns are also memory-mapped, so
+    only the rows that are used are read.
+
+    If `since` is given, only the rows dated after `since` are returned
+    (see `rows_since`). `cols` must then include 'date'.
+
+    """
+    stamp = src_stamp(pth)
+    size = int(stamp[0])
+    layout = layout_key(src_cols, src_col_dtypes, src_col_widths)
+    args = (src_cols, src_col_dtypes, src_col_widths, use_mmap)
+    meta = read_meta(pth, cache_dir)
+    if meta is not None and meta['layout'] == layout:
+        cached = [c for c in meta['cols'] if c in src_cols]
+        missing = [c for c in cols if c not in cached]
+        dtypes = {c: meta['dtypes'][c] for c in cached}
+        rows, tail, ordered = meta['rows'], meta['tail'], meta['ordered']
+
+        # The cached version ends at byte `offset` of the current file if the
+        # file was only appended to
+        offset = int(meta['stamp'][0])
+        unchanged = np.array_equal(meta['stamp'], stamp)
+        appended = (not unchanged and 0 < offset < size and tail.size
+                    and file_tail(pth, offset, tail.size) == tail.tobytes())
+        if unchanged or appended:
+            if appended:
+                new_data = parse_dat_cols(pth, cached, *args, offset, size)
+                if ordered:
+                    # Still in order if the new dates follow the last cached one
+                    last = read_cols(pth, cache_dir, ['date'], dtypes, rows, True)['date']
+                    ordered = dates_ordered(np.concatenate([last[-1:], new_data['date']]))
+                append_cols(pth, cache_dir, new_data, rows)
+                rows += len(new_data[cached[0]]) if cached else 0
+                tail = mk_tail(pth, size)
+            new_data = {}
+            if missing:
+                new_data = parse_dat_cols(pth, missing, *args, 0, size)
+                write_cols(pth, cache_dir, new_data)
+                dtypes.update(col_dtypes(new_data))
+                rows = len(new_data[missing[0]])
+                if 'date' in new_data:
+                    ordered = dates_ordered(new_data['date'])
+            if appended or missing:
+                write_meta(pth, cache_dir, stamp, dtypes, rows, layout, tail, ordered)
+            data = read_cols(pth, cache_dir, [c for c in cols if c in cached],
+                             dtypes, rows, use_mmap)
+            data.update(new_data)
+            data = {c: data[c] for c in cols}
+            return data if since is None else rows_since(data, since, ordered)
+
+    data = parse_dat_cols(pth, cols, *args, 0, size)
+    ordered = 'date' in data and dates_ordered(data['date'])
+    write_cache(pth, cache_dir, stamp, data, layout, mk_tail(pth, size), ordered)
+    return data if since is None else rows_since(data, since, ordered)
+
+
+def sort_by_date(pth, dates, data):
+    """ Returns `dates` (datetime64 values read from the DAT file at `pth`)
+    and the arrays in the dict `data` in date order.
+
+    DAT files are almost always already in date order, so this is checked
+    first in one pass, and the arrays are only sorted if they are not.
+    Duplicate dates are reported with a warning, since a series with
+    duplicate dates cannot be aligned with the other tickers.
+
+    """
+    steps = np.diff(dates.view(np.int64))
+    if (steps < 0).any():
+        order = np.argsort(dates, kind='stable')
+        dates = dates[order]
+        data = {col: values[order] for col, values in data.items()}
+        steps = np.diff(dates.view(np.int64))
+    n_dups = int(np.count_nonzero(steps == 0))
+    if n_dups:
+        first = dates[1:][steps == 0][0]
+        warnings.warn("{}: {} duplicate date(s), the first on {}".format(
+            pth, n_dups, np.datetime_as_string(first, unit='D')))
+    return dates, data
 
 
 # ----------------------------------------------------------------------------
@@ -99,6 +815,9 @@ def dat_to_df(pth,
               src_cols,
               src_col_dtypes,
               src_col_widths,
+              use_mmap=False,
+              usecols=None,
+              cache_dir=None,
               ):
     """ This function creates a dataframe with the contents of a DAT file
     containing stock price information for a given ticker.
@@ -122,6 +841,23 @@ def dat_to_df(pth,
         A dictionary mapping each column name in `src_cols` to its column
         width as it appears in the `README.txt` file.
 
+    use_mmap : bool, optional
+        If True, memory-map the DAT file instead of reading it into memory.
+        Only the bytes of each column are copied, when that column is
+        converted.
+
+    usecols : list, optional
+        Columns in `src_cols` to include in the dataframe. The 'date' column
+        is always parsed, since it becomes the index. Columns not listed here
+        are never converted. By default, all columns are included.
+
+    cache_dir : str, optional
+        Folder with the binary cache of parsed DAT files. If given, the
+        columns are loaded from the cache when the DAT file has not changed
+        since it was cached. If rows were only appended to the file, just
+        the new rows are parsed and added to the cache entry. Otherwise, the
+        cache entry is rebuilt.
+
 
     Returns
     -------
@@ -144,50 +880,111 @@ def dat_to_df(pth,
 
     """
 
-    # Read the file
-    dat_file_rows = open(pth).read().strip().split("\n")
-
-    # An array of string arrays with each string being row column data
-    parsed_dat_file = []
-    # Array of data strings from dat file
-    parsed_dates_index = []
-    # An index for all of the column lables used in the internal parsed_dat_file array
-    parsed_dat_columns = []
-
-    # Loop through every row in the dat file and parse out the columns in the row
-    for row in dat_file_rows:
-        # Create some arrays to track the current rows state while looping through the columns
-        current_row = row
-        current_parsed_data = []
-
-        # Loop through the src_cols array to get the correct column order and parse out the width
-        for col in src_cols:
-            # Get the width of the current column being looped over
-            col_width = src_col_widths[col]
-            # Slice the current column from 0 to the current column width
-            col_data = current_row[:col_width]
-            # Remove the prefix of the string from 0 to the current column width
-            # so that the next column width is index from the correct postion
-            current_row = current_row[col_width:]
-
-            if col == "date":
-                # We want to track the dates in the date index so we can use it as the index for our data frame
-                parsed_dates_index.append(col_data)
-            else:
-                # Any other columns can be added to the current rows array of strings representing the columns in the row
-                current_parsed_data.append(col_data)
-                # Append the current column label to the parsed_dat_columns index so we have an index for the current_parsed_data
-                # columns which would not match src_cols array
-                if not parsed_dat_columns.__contains__(col):
-                    parsed_dat_columns.append(col)
-
-        # Once all columns have been parsed from the dat file add them to the array of string arrays representing the whole dat file
-        parsed_dat_file.append(current_parsed_data)
-
-    df = pd.DataFrame(parsed_dat_file, pd.DatetimeIndex(parsed_dates_index), parsed_dat_columns)
-    df.sort_index(inplace=True)
+    # Keep only the requested columns (in the README order) plus the date
+    if usecols is None:
+        usecols = src_cols
+    cols = [c for c in src_cols if c in usecols or c == 'date']
+
+    # Decode every column in bulk from its fixed-width byte slice into the
+    # dtype given by `src_col_dtypes` (going through the cache if any)
+    args = (pth, cols, src_cols, src_col_dtypes, src_col_widths, use_mmap)
+    if cache_dir is None:
+        data = parse_dat_cols(*args)
+    else:
+        data = load_dat_cols(*args, cache_dir=cache_dir)
+
+    # The date column becomes the index (sorted only if the file is not in
+    # date order), the other columns keep the README order
+    dates, data = sort_by_date(pth, data.pop('date'), data)
+    df = pd.DataFrame(data, index=pd.DatetimeIndex(dates),
+                      columns=[c for c in cols if c != 'date'])
     return(df)
 
+
+def read_adj_close(ticker, srcdir, src_cols, src_col_dtypes, src_col_widths,
+                   cache_dir=None, chunk_rows=None, since=None):
+    """ Returns a series with the adjusted closing prices in the DAT file of
+    `ticker` (indexed by date). Used by `mk_prc_df` for each ticker.
+
+    If `chunk_rows` is given (and `cache_dir` is not), the file is read in
+    blocks of `chunk_rows` lines (see `iter_dat_chunks`), keeping only the
+    dates and prices of each block.
+
+    If `since` is given, only the prices dated after `since` are returned
+    (see `update_prc_df`). The rows are selected before the series is built.
+    With `cache_dir`, the cached columns are memory-mapped and the first new
+    row is found by binary search (see `rows_since`), so only the new rows
+    are read.
+
+    """
+    # Read the data file and convert it into an input for dat_to_df
+    dat_file_path = os.path.join(srcdir, ticker.lower() + '_prc.dat')
+
+    if since is not None:
+        args = (dat_file_path, ['date', 'adjClose'], src_cols, src_col_dtypes,
+                src_col_widths, True)
+        if cache_dir is None:
+            data = rows_since(parse_dat_cols(*args), since)
+        else:
+            data = load_dat_cols(*args, cache_dir=cache_dir, since=since)
+        dates, data = sort_by_date(dat_file_path, data.pop('date'), data)
+        return pd.Series(data['adjClose'], index=pd.DatetimeIndex(dates), name='adjClose')
+
+    if chunk_rows is not None and cache_dir is None:
+        # The arrays are sized for every line of the file (from the line
+        # stride) and filled one block at a time, so only one block is held
+        # besides the dates and prices
+        row_width = sum(src_col_widths[c] for c in src_cols)
+        size = os.path.getsize(dat_file_path)
+        n_rows = -(-size // dat_line_stride(dat_file_path, row_width)) if size else 0
+        data = {'date': np.empty(n_rows, dtype='datetime64[ns]'),
+                'adjClose': np.empty(n_rows, dtype=src_col_dtypes['adjClose'])}
+        n_read = 0
+        for chunk in iter_dat_chunks(dat_file_path, ['date', 'adjClose'], src_cols,
+                                     src_col_dtypes, src_col_widths, chunk_rows):
+            n_chunk = len(chunk['date'])
+            for col, values in data.items():
+                values[n_read:n_read + n_chunk] = chunk[col]
+            n_read += n_chunk
+        dates, data = sort_by_date(dat_file_path, data['date'][:n_read],
+                                   {'adjClose': data['adjClose'][:n_read]})
+        return pd.Series(data['adjClose'], index=pd.DatetimeIndex(dates), name='adjClose')
+
+    # Data file is read into dat_to_df method and a dataframe is generated
+    # Only the 'date' and 'adjClose' fields are decoded from the mapped file
+    return dat_to_df(dat_file_path, src_cols, src_col_dtypes, src_col_widths,
+                     use_mmap=True, usecols=['date', 'adjClose'],
+                     cache_dir=cache_dir).loc[:, 'adjClose']
+
+
+def mk_panel(series_list, columns):
+    """ Aligns the date-indexed series in `series_list` into one dataframe
+    (one column per series, labelled by `columns`) indexed by the union of
+    their dates. Dates missing from a series take a NaN value.
+
+    The union index is built once and each series is scattered into a
+    preallocated float64 block, instead of reindexing in `pd.concat`.
+
+    """
+    # Dates of each series as int64 arrays (nanoseconds), merged into the
+    # union a batch of series at a time so that all the dates are never
+    # copied at once
+    dates = [np.asarray(s.index.values, dtype='datetime64[ns]').view('i8')
+             for s in series_list]
+    all_dates = np.empty(0, dtype='i8')
+    for i in range(0, len(dates), 64):
+        all_dates = np.union1d(all_dates, np.concatenate(dates[i:i + 64]))
+
+    # Fill one column at a time at the positions of that series' dates. The
+    # block is stored column by column, which is also how pandas keeps it
+    block = np.full((len(series_list), len(all_dates)), np.nan)
+    for j, (col_dates, ser) in enumerate(zip(dates, series_list)):
+        block[j, np.searchsorted(all_dates, col_dates)] = ser.values
+
+    index = pd.DatetimeIndex(all_dates.view('datetime64[ns]'))
+    return pd.DataFrame(block.T, index=index, columns=list(columns), copy=False)
+
+
 # ----------------------------------------------------------------------------
 #   Function mk_prc_df
 # ----------------------------------------------------------------------------
@@ -197,6 +994,9 @@ def mk_prc_df(
         src_cols,
         src_col_dtypes,
         src_col_widths,
+        workers=1,
+        cache_dir=None,
+        chunk_rows=None,
 ):
     """ This function creates a dataframe from the information found in
     a DAT file located at `pth`
@@ -204,7 +1004,8 @@ def mk_prc_df(
     Parameters
     ----------
     tickers : list
-        List of tickers in the order they appear in the TICKERS.txt file
+        List of tickers in the order they appear in the TICKERS.txt file,
+        each ticker once (see `get_tics`)
 
     srcdir : str
         Directory containing the source files:
@@ -224,6 +1025,18 @@ def mk_prc_df(
         A dictionary mapping each column name in `src_cols` to its column
         width as it appears in the `README.txt` file.
 
+    workers : int, optional
+        Number of processes used to read the DAT files. If 1 (the default),
+        the files are read one after another in this process.
+
+    cache_dir : str, optional
+        Folder with the binary cache of parsed DAT files (see `dat_to_df`).
+
+    chunk_rows : int, optional
+        If given, read the DAT files that are not cached in blocks of this
+        many lines (see `read_adj_close`), for files too large to map and
+        convert at once.
+
 
     Returns
     -------
@@ -235,9 +1048,10 @@ def mk_prc_df(
         - df.index: DatetimeIndex with dates.
 
         - df.columns: each column label will contain the ticker code
-          (in lower case). The number of columns in this dataframe must correspond
-          to the number of tickers in the `TICKERS.txt` file above. The order
-          of the columns must match the order of the tickers in `TICKERS.txt`.
+          (in lower case). There is one column per ticker in `tickers`, i.e.
+          per distinct ticker in the `TICKERS.txt` file above (23 columns for
+          its 24 lines, since INTC is listed twice). The order of the
+          columns is the order of first appearance in `TICKERS.txt`.
 
         - The data inside each column (i.e. series) will contain the closing
           prices included in each DAT file (the Adj Close column). All valid
@@ -266,38 +1080,129 @@ def mk_prc_df(
 
     """
 
-    # Empty date index to union with the created data frame data indexes
+    # Read the adjClose series of every ticker, in the order of `tickers`.
+    # Each file is parsed independently, so they can be loaded in parallel
+    load = functools.partial(read_adj_close, srcdir=srcdir, src_cols=src_cols,
+                             src_col_dtypes=src_col_dtypes,
+                             src_col_widths=src_col_widths,
+                             cache_dir=cache_dir, chunk_rows=chunk_rows)
+    if workers > 1:
+        # Send the tickers in a few chunks per worker to limit the overhead
+        chunksize = max(1, len(tickers) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            adj_close_ticker = map_stages(executor, 'read_adj_close', load, tickers,
+                                          chunksize)
+    else:
+        adj_close_ticker = []
+        for ticker in tickers:
+            with stage('read_adj_close', tic=ticker) as stats:
+                adj_close_ticker.append(load(ticker))
+                stats['rows_out'] = len(adj_close_ticker[-1])
+
+    # Align the series on the union of their dates, with the tickers as the
+    # column labels
+    return mk_panel(adj_close_ticker, tickers)
 
-    adj_close_ticker = []
-    ticker_name = []
 
-    for ticker in tickers:
-        # Append the name of the pth currently being passed into ticker_name set to be used as column labels
-        ticker_name.append(ticker)
+# ----------------------------------------------------------------------------
+#   Fama-French factor store
+# ----------------------------------------------------------------------------
+# FF_STORE maps the absolute path of each factors CSV file already loaded in
+# this process to a (stamp, dataframe) tuple (see `get_ff_df`)
+FF_STORE = {}
 
-        # Read the data file and convert it into an input for dat_to_df
-        dat_file_path = os.path.join(srcdir, ticker + '_prc.dat').lower()
 
-        # Data file is read into dat_to_df method and a dataframe is generated
-        # Use .loc method to extract 'adjClose' column from dat_to_df function
-        result_df_adjClose = dat_to_df(dat_file_path, src_cols,
-                                       src_col_dtypes, src_col_widths).loc[:, 'adjClose']
+def read_ff_df(pth, cache_dir=None):
+    """ Reads the Fama-French factors CSV file at `pth` (e.g. `FF_CSV`) into
+    a dataframe indexed by 'Date', with one float64 column per factor
+    ('mkt-rf', 'smb', 'hml', 'rf' and 'mkt').
 
-        # Append each column that gets passed into adj_close_ticker set
-        adj_close_ticker.append(result_df_adjClose)
+    If `cache_dir` is given, the factors are loaded from the binary cache
+    when the CSV file has not changed since it was cached.
 
-    # Use .concat to append different the sets into a dataframe object
-    df_concat_adjClose = pd.concat(adj_close_ticker, axis=1)
-    # Use .columns to rename the dataframe labels to the extracted ticker
-    df_concat_adjClose.columns = ticker_name
-    #This function is working, just need to fix dat_to_df to make it run corrrectly!
-    print(df_concat_adjClose)
+    """
+    data = None
+    if cache_dir is not None:
+        stamp = src_stamp(pth)
+        data = read_cache(pth, cache_dir)
+
+    if data is None:
+        # The dates are always in YYYY-MM-DD format, so skip format inference
+        ff_df = pd.read_csv(pth, index_col='Date', parse_dates=['Date'],
+                            date_format='%Y-%m-%d')
+        ff_df = ff_df.astype('float64')
+        if cache_dir is not None:
+            data = {'Date': ff_df.index.values}
+            data.update({c: ff_df[c].values for c in ff_df.columns})
+            write_cache(pth, cache_dir, stamp, data)
+        return ff_df
+
+    dates = pd.DatetimeIndex(data.pop('Date'), name='Date')
+    return pd.DataFrame(data, index=dates)
+
+
+def get_ff_df(pth, cache_dir=None):
+    """ Returns the Fama-French factors in the CSV file at `pth` (see
+    `read_ff_df`).
+
+    The factors are only read the first time this function is called for
+    `pth` (or after the file changes). Later calls return the same
+    dataframe, so it must not be modified in place.
 
+    """
+    key = os.path.abspath(pth)
+    stamp = src_stamp(pth)
+    if key in FF_STORE and np.array_equal(FF_STORE[key][0], stamp):
+        return FF_STORE[key][1]
+    ff_df = read_ff_df(pth, cache_dir)
+    FF_STORE[key] = (stamp, ff_df)
+    return ff_df
+
+
+def ff_slice(pth, start=None, end=None, cols=None, cache_dir=None):
+    """ Returns the Fama-French factors in the CSV file at `pth` for the
+    dates between `start` and `end` (both included, None means no bound),
+    keeping only the factors in the list `cols` (all of them if None).
+
+    The factors come from the store (see `get_ff_df`), so the CSV file is not
+    read again.
+
+    """
+    ff_df = get_ff_df(pth, cache_dir)
+    # The index is sorted, so the date range is found by binary search
+    ff_df = ff_df.loc[start:end]
+    if cols is not None:
+        ff_df = ff_df.loc[:, cols]
+    return ff_df
 
 
 # ----------------------------------------------------------------------------
 #   Function mk_aret_df
 # ----------------------------------------------------------------------------
+def mk_ff_rets(prc_df):
+    """ Returns the daily returns of the prices in `prc_df` on the dates with
+    Fama-French factors (see `get_ff_df`), as a tuple with:
+
+    - a 2-D array with the returns of every column of `prc_df` on those dates
+    - a boolean array marking those dates in `prc_df.index`
+    - a dataframe with the factors on those dates, in the same order
+
+    Used by `mk_aret_df` and `mk_model_aret_df`.
+
+    """
+    # Same as prc_df.pct_change(fill_method=None), computed on the whole price
+    # block at once: a missing price gives NaN returns on its date and the
+    # next one, where plain pct_change() would forward-fill the price
+    prices = prc_df.to_numpy(dtype='float64')
+    rets = np.full(prices.shape, np.nan)
+    rets[1:] = prices[1:] / prices[:-1] - 1
+
+    ff_df = get_ff_df(FF_CSV, CACHEDIR)
+    ff_pos = ff_df.index.get_indexer(prc_df.index)
+    in_ff = ff_pos >= 0
+    return rets[in_ff], in_ff, ff_df.iloc[ff_pos[in_ff]]
+
+
 def mk_aret_df(prc_df):
     """ Creates a dataframe with abnormal returns given the price information
     contained in the `prc_df`
@@ -358,23 +1263,347 @@ def mk_aret_df(prc_df):
     #    2020-10-12  0.063521  0.019124
     #    ...              ...       ...
     # --------------------------------------------------------
-    ret_df = '<COMPLETE THIS PART>'
-
     # --------------------------------------------------------
-    #   Load FF mkt rets (do not change this part)
+    #   Load FF mkt rets and align them with the returns
+    #   (keeping only the dates with a market return)
     # --------------------------------------------------------
-    ff_df = pd.read_csv(FF_CSV, index_col='Date', parse_dates=['Date'])
-    aret_df = ret_df.join(ff_df.mkt, how='inner')
+    arets, in_ff, ff_rows = mk_ff_rets(prc_df)
+    mkt = ff_rows['mkt'].values
 
     # --------------------------------------------------------
     #   Create abnormal rets
     # --------------------------------------------------------
-    for tic in ret_df.columns:
-        aret_df.loc[:, tic] = '<COMPLETE THIS PART>'
-    del aret_df['mkt']
+    # Subtract the market return from every column at once
+    arets -= mkt[:, np.newaxis]
+    aret_df = pd.DataFrame(arets, index=prc_df.index[in_ff], columns=prc_df.columns,
+                           copy=False)
+    return aret_df
+
+
+def iter_chunk_arets(chunks, col='adjClose'):
+    """ Yields the dates and the abnormal returns (as in `mk_aret_df`) of the
+    column `col` for each block in `chunks` (see `iter_dat_chunks`), keeping
+    only the dates with a market return.
+
+    The returns come from `iter_chunk_rets`, so a DAT file too large to load
+    at once is processed one block at a time.
+
+    """
+    ff_df = get_ff_df(FF_CSV, CACHEDIR)
+    mkt = ff_df['mkt'].values
+    for dates, rets in iter_chunk_rets(chunks, col):
+        ff_pos = ff_df.index.get_indexer(dates)
+        in_ff = ff_pos >= 0
+        yield dates[in_ff], rets[in_ff] - mkt[ff_pos[in_ff]]
+
+
+# ----------------------------------------------------------------------------
+#   Factor model abnormal returns
+# ----------------------------------------------------------------------------
+# AR_MODELS maps the name of each abnormal return model to the list of
+# factors (columns of ff_daily.csv) it regresses the stock returns on, and to
+# whether the stock returns are taken in excess of the risk-free rate:
+# - 'market': market model, r = a + b * mkt
+# - 'ff3': Fama-French 3-factor model, r - rf = a + b1 * (mkt-rf) + b2 * smb + b3 * hml
+AR_MODELS = {
+    'market': (['mkt'], False),
+    'ff3': (['mkt-rf', 'smb', 'hml'], True),
+}
+
+
+def batch_ols(y, X):
+    """ Fits the regressions y[e] = X[e] @ b[e] by least squares for every
+    `e` at once, where `y` has shape (E, L) and `X` has shape (E, L, K).
+
+    Observations with a NaN in `y` or in `X` are left out of their
+    regression. Returns an (E, K) array with the coefficients, which are NaN
+    for regressions with fewer than K + 1 valid observations.
+
+    """
+    n_coef = X.shape[2]
+    valid = ~np.isnan(y + X.sum(axis=2))
+    y = np.where(valid, y, 0.0)
+    X = np.where(valid[:, :, np.newaxis], X, 0.0)
+
+    # Solve the normal equations of all the regressions in one batch
+    Xt = X.transpose(0, 2, 1)
+    XtX = Xt @ X
+    Xty = Xt @ y[:, :, np.newaxis]
+    try:
+        coefs = np.linalg.solve(XtX, Xty)[:, :, 0]
+    except np.linalg.LinAlgError:
+        # Some regressors are collinear (or missing), so use the pseudo-inverse
+        coefs = (np.linalg.pinv(XtX) @ Xty)[:, :, 0]
+    coefs[valid.sum(axis=1) <= n_coef] = np.nan
+    return coefs
+
+
+def take_window(block, day0, offsets, col=None):
+    """ Returns the rows `day0[e] + offsets` of `block` for every event `e`
+    (only column `col[e]` if `col` is given), with NaN for rows outside the
+    block.
+
+    """
+    rows = day0[:, np.newaxis] + offsets[np.newaxis, :]
+    outside = (rows < 0) | (rows >= len(block))
+    rows = np.clip(rows, 0, len(block) - 1)
+    if col is None:
+        vals = block[rows]
+    else:
+        vals = block[rows, col[:, np.newaxis]]
+    vals[outside] = np.nan
+    return vals
+
+
+def mk_model_aret_df(prc_df, event_df, model='market', est_window=(-250, -11),
+                     window=(-2, 2)):
+    """ Computes abnormal returns around each event in `event_df` using a
+    factor model (see `AR_MODELS`) estimated over a window before that event.
+
+    Parameters
+    ----------
+    prc_df : dataframe
+        Dataframe produced by the function `mk_prc_df` above
+
+    event_df : dataframe
+        One row per event, with the columns 'tic' (a column of `prc_df`) and
+        'event_date' (datetime)
+
+    model : str, optional
+        Name of the model in `AR_MODELS` ('market' or 'ff3')
+
+    est_window : tuple, optional
+        (first, last) trading days of the estimation window, relative to the
+        event date
+
+    window : tuple, optional
+        (first, last) trading days of the event window, relative to the
+        event date
+
+    Returns
+    -------
+    dataframe
+        The rows of `event_df`, each repeated once per day in the event
+        window, with the columns:
+
+        - 'event_time': trading day relative to the event date
+        - 'aret': return minus the return predicted by the model fitted
+          for that event (NaN if the return or the fit is not available)
+
+    Notes
+    -----
+    - Only dates with Fama-French factors are trading days. Event day 0 is
+      the first trading day on or after 'event_date'. Events after the last
+      trading day have NaN abnormal returns.
+
+    - The regressions of all the events are solved in one batch (see
+      `batch_ols`).
+
+    """
+    factors, excess = AR_MODELS[model]
+
+    # Returns and factors on the dates with Fama-French data
+    rets, in_ff, ff_rows = mk_ff_rets(prc_df)
+    if excess:
+        rets -= ff_rows['rf'].values[:, np.newaxis]
+    X = np.column_stack([np.ones(len(rets)), ff_rows.loc[:, factors].values])
+    dates = prc_df.index[in_ff].values.astype('datetime64[ns]')
+
+    # Column of each event's ticker (the first one if a ticker appears twice)
+    first_col = {tic: j for j, tic in reversed(list(enumerate(prc_df.columns)))}
+    col = np.array([first_col[tic] for tic in event_df['tic']], dtype=np.intp)
+    day0 = np.searchsorted(dates, event_df['event_date'].values.astype('datetime64[ns]'))
+
+    # Fit the model of every event over its estimation window
+    est_days = np.arange(est_window[0], est_window[1] + 1)
+    coefs = batch_ols(take_window(rets, day0, est_days, col),
+                      take_window(X, day0, est_days))
+
+    # Abnormal returns over the event window
+    evt_days = np.arange(window[0], window[1] + 1)
+    arets = (take_window(rets, day0, evt_days, col)
+             - np.einsum('ewk,ek->ew', take_window(X, day0, evt_days), coefs))
+    # Events after the last trading day have no event window
+    arets[day0 >= len(dates)] = np.nan
+
+    aret_df = event_df.iloc[np.repeat(np.arange(len(event_df)), len(evt_days))]
+    aret_df = aret_df.reset_index(drop=True)
+    aret_df.loc[:, 'event_time'] = np.tile(evt_days, len(event_df))
+    aret_df.loc[:, 'aret'] = arets.ravel()
     return aret_df
 
 
+# ----------------------------------------------------------------------------
+#   Incremental updates of the price and abnormal return dataframes
+# ----------------------------------------------------------------------------
+def last_valid_rows(block):
+    """ Returns the row of the last non-NaN value of each column of the 2-D
+    array `block` (-1 for a column without any).
+
+    The rows are scanned back from the end in blocks of growing size, so the
+    cost depends on how far back these values are, not on the whole length
+    of `block`.
+
+    """
+    last = np.full(block.shape[1], -1)
+    todo = np.arange(block.shape[1])
+    stop, step = len(block), 64
+    while len(todo) and stop > 0:
+        start = max(0, stop - step)
+        valid = ~np.isnan(block[start:stop, todo])
+        found = valid.any(axis=0)
+        last[todo[found]] = stop - 1 - valid[::-1, found].argmax(axis=0)
+        todo = todo[~found]
+        stop, step = start, 2 * step
+    return last
+
+
+def merge_new_rows(df, new_df):
+    """ Returns `df` (indexed by sorted dates) with the values of `new_df`
+    (same columns, indexed by sorted dates) merged in by date.
+
+    The rows of `new_df` dated up to the last date of `df` only fill in
+    values: their non-NaN values are written into `df` in place (unless one
+    of their dates is not in `df`, in which case the rows are merged with
+    `combine_first`, which copies `df`). The later rows are appended to `df`:
+    pandas cannot grow a dataframe in place, so this copies `df` once (one
+    copy of its values, without parsing or realigning anything).
+
+    """
+    n_old = new_df.index.searchsorted(df.index[-1], side='right')
+    if n_old:
+        old_df = new_df.iloc[:n_old]
+        pos = df.index.searchsorted(old_df.index)
+        if (df.index[pos] == old_df.index).all():
+            values = old_df.to_numpy()
+            for j in np.flatnonzero(~np.isnan(values).all(axis=0)):
+                rows = np.flatnonzero(~np.isnan(values[:, j]))
+                df.iloc[pos[rows], j] = values[rows, j]
+        else:
+            df = df.combine_first(old_df)
+    if n_old < len(new_df):
+        df = pd.concat([df, new_df.iloc[n_old:]])
+    return df
+
+
+def update_prc_df(prc_df, srcdir, src_cols, src_col_dtypes, src_col_widths,
+                  cache_dir=None):
+    """ Returns `prc_df` (created by `mk_prc_df`) updated with the prices in
+    the DAT file of each ticker in `prc_df.columns` dated after the last
+    price of that ticker in `prc_df`.
+
+    The new prices are merged by date (see `merge_new_rows`): those dated
+    after the last date of `prc_df` become new rows, and the others fill in,
+    in place, the missing prices of tickers whose files were updated later
+    than the others.
+
+    With `cache_dir`, only the rows appended to each DAT file since it was
+    cached are parsed and added to the cache (see `load_dat_cols`), and only
+    the new prices are read from it. Finding, reading and filling in the new
+    prices costs in proportion to the new rows, but adding rows copies the
+    whole panel once, since pandas cannot grow a dataframe in place.
+
+    """
+    last_rows = last_valid_rows(prc_df.to_numpy())
+    new_prcs = []
+    for ticker, last in zip(prc_df.columns, last_rows):
+        since = prc_df.index[last] if last >= 0 else None
+        new_prcs.append(read_adj_close(ticker, srcdir, src_cols, src_col_dtypes,
+                                       src_col_widths, cache_dir, since=since))
+    new_prc_df = mk_panel(new_prcs, prc_df.columns)
+    if new_prc_df.empty:
+        return prc_df
+    return merge_new_rows(prc_df, new_prc_df)
+
+
+def update_aret_df(aret_df, prc_df):
+    """ Returns `aret_df` (created by `mk_aret_df`) updated with the prices in
+    `prc_df` (see `update_prc_df`), which has the same columns.
+
+    The abnormal returns are computed again after the earliest last
+    abnormal return of the tickers with prices after it, so the dates after
+    the last date of `aret_df` are added, and the prices filled in for a
+    ticker updated later than the others are used. Only those rows of
+    `prc_df` (and the row before them) are used, and they are merged into
+    `aret_df` as in `update_prc_df` (see `merge_new_rows`).
+
+    """
+    prices = prc_df.to_numpy()
+    since = aret_df.index[-1]
+    for j, last in enumerate(last_valid_rows(aret_df.to_numpy())):
+        start = aret_df.index[max(last, 0)]
+        if start < since:
+            pos = prc_df.index.searchsorted(start, side='right')
+            if not np.isnan(prices[pos:, j]).all():
+                since = start
+    new_aret_df = mk_aret_df(prc_df.iloc[prc_df.index.searchsorted(since):])
+    new_aret_df = new_aret_df.iloc[new_aret_df.index.searchsorted(since, side='right'):]
+    if new_aret_df.empty:
+        return aret_df
+    return merge_new_rows(aret_df, new_aret_df)
+
+
+# ----------------------------------------------------------------------------
+#   Shared categorical code tables
+# ----------------------------------------------------------------------------
+# CODE_TABLES holds the categories of the categorical columns used by the
+# event functions below. The same table is shared by all the tickers, so the
+# integer code of a value (e.g. a firm) is the same in every dataframe and
+# can be filtered, grouped and joined on directly. New values are appended
+# to the end of their table, so existing codes never change.
+CODE_TABLES = {
+    'firm': [],
+    'action': ['up', 'down', 'init', 'main', 'reit'],
+    'event_type': ['downgrade', 'upgrade'],
+}
+
+
+def mk_shared_cat(table, values):
+    """ Returns a Categorical with the `values` encoded with the shared
+    categories in `CODE_TABLES[table]` (adding the values not in the table
+    yet). Missing values stay missing.
+
+    """
+    cats = CODE_TABLES[table]
+    values = pd.Categorical(values)
+
+    # Add the new values to the table, then map the codes of `values` to the
+    # codes of the table
+    known = set(cats)
+    cats.extend(c for c in values.categories if c not in known)
+    to_shared = pd.Index(cats).get_indexer(values.categories)
+    codes = np.where(values.codes >= 0, to_shared[values.codes], -1)
+    return pd.Categorical.from_codes(codes, categories=cats)
+
+
+def shared_codes(table, values):
+    """ Returns the integer codes of `values` in the shared table `table`
+    (-1 for missing values). `values` may be strings or a categorical with
+    any categories, e.g. after concatenating dataframes built while the
+    table was growing.
+
+    """
+    return mk_shared_cat(table, values).codes
+
+
+def alpha_rank(table):
+    """ Returns an array with the rank of each category of the shared table
+    `table` in alphabetical order (indexed by code)
+
+    """
+    order = np.argsort(np.array(CODE_TABLES[table], dtype=object), kind='stable')
+    rank = np.empty(len(order), dtype=np.intp)
+    rank[order] = np.arange(len(order))
+    return rank
+
+
+def code_of(table, value):
+    """ Returns the integer code of `value` in the shared table `table`
+
+    """
+    return CODE_TABLES[table].index(value)
+
+
 # ----------------------------------------------------------------------------
 #   Function read_rec_csv
 # ----------------------------------------------------------------------------
@@ -398,10 +1627,12 @@ def read_rec_csv(tic):
 
         - df.columns: index with labels ['event_day', 'firm', 'action'], in
           this order, where
-            - 'event_day': String representing the date of the recommendation
-              (no timestamp) following the format in the Notes section below
-            - 'firm': Firm the analyst belongs to (source column 'Firm').
-            - 'action': Information from the source column 'Action'
+            - 'event_day': Date of the recommendation (the timestamp
+              floored to midnight, as a datetime64)
+            - 'firm': Firm the analyst belongs to (source column 'Firm'),
+              as a categorical with the shared codes in `CODE_TABLES`.
+            - 'action': Information from the source column 'Action', as a
+              categorical with the shared codes in `CODE_TABLES`.
 
     Notes
     -----
@@ -429,22 +1660,113 @@ def read_rec_csv(tic):
         Data columns (total 3 columns):
          #   Column     Non-Null Count  Dtype
         ---  ------     --------------  -----
-         0   event_day  132 non-null    object
-         1   firm       132 non-null    object
-         2   action     132 non-null    object
-        dtypes: object(3)
+         0   event_day  132 non-null    datetime64[ns]
+         1   firm       132 non-null    category
+         2   action     132 non-null    category
+        dtypes: category(2), datetime64[ns](1)
+
+    - Only the columns 'Date', 'Firm' and 'Action' are read from the CSV
+      file, and the timestamps are parsed with an explicit format.
+
+    """
+    pth = os.path.join(SRCDIR, tic + '_rec.csv')
+    df = pd.read_csv(pth, usecols=['Date', 'Firm', 'Action'],
+                     dtype={'Firm': 'category', 'Action': 'category'})
+
+    # The timestamps are always in this format, so skip format inference
+    dates = pd.DatetimeIndex(pd.to_datetime(df['Date'].values,
+                                            format='%Y-%m-%d %H:%M:%S')).as_unit('ns')
+
+    rec_df = pd.DataFrame({
+        'event_day': dates.floor('D'),
+        'firm': mk_shared_cat('firm', df['Firm'].values),
+        'action': mk_shared_cat('action', df['Action'].values),
+    }, index=dates)
+    return rec_df
+
+
+def read_rec_csvs(tickers):
+    """ Reads the recommendations of every ticker in `tickers` (see
+    `read_rec_csv`) into one dataframe.
 
+    Parameters
+    ----------
+    tickers : list
+        List of tickers in lower case characters and without spaces
+
+    Returns
+    -------
+    df
+        A Pandas dataframe with the rows of each ticker one after another,
+        and the columns ['event_day', 'firm', 'action', 'tic'], where 'tic'
+        is a categorical with the categories `tickers`.
 
     """
-    # <COMPLETE THIS PART>
+    rec_dfs = []
+    for tic in tickers:
+        with stage('read_rec_csv', tic=tic) as stats:
+            rec_dfs.append(read_rec_csv(tic))
+            stats['rows_out'] = len(rec_dfs[-1])
+
+    # The shared tables only grow, so the codes of the first dataframes are
+    # still valid in the final tables
+    def concat_cat(table, col):
+        codes = np.concatenate([df[col].cat.codes.values for df in rec_dfs])
+        return pd.Categorical.from_codes(codes, categories=CODE_TABLES[table])
+
+    n_rows = [len(df) for df in rec_dfs]
+    rec_df = pd.DataFrame({
+        'event_day': np.concatenate([df['event_day'].values for df in rec_dfs]),
+        'firm': concat_cat('firm', 'firm'),
+        'action': concat_cat('action', 'action'),
+        'tic': pd.Categorical.from_codes(np.repeat(np.arange(len(tickers)), n_rows),
+                                         categories=tickers),
+    }, index=pd.DatetimeIndex(np.concatenate([df.index.values for df in rec_dfs])))
+    return rec_df
+
+
+def top_n_mask(counts, n, rank):
+    """ Selects the top `n` firms of each row of `counts`, a (groups x firms)
+    array with the number of recommendations of each firm in each group.
+    Firms are ranked by count (descending), and ties are broken by `rank`
+    (ascending, e.g. `alpha_rank('firm')`). Firms with no recommendation are
+    never selected.
+
+    Returns a boolean array shaped like `counts`.
+
+    Notes
+    -----
+    Only a partial selection is done: the n-th largest count of each row is
+    found with `np.partition`, every firm above it is kept, and only the
+    firms tied at that count are ordered by `rank` to fill the remaining
+    slots.
+
+    """
+    if counts.shape[1] <= n:
+        return counts > 0
+
+    # n-th largest count of each group
+    nth = -np.partition(-counts, n - 1, axis=1)[:, n - 1]
+    above = counts > nth[:, np.newaxis]
+    tied = (counts == nth[:, np.newaxis]) & (counts > 0)
 
+    # Fill the remaining slots with the tied firms in `rank` order
+    n_left = n - above.sum(axis=1)
+    order = np.argsort(rank)
+    tied_sorted = tied[:, order]
+    take_sorted = tied_sorted & (np.cumsum(tied_sorted, axis=1) <= n_left[:, np.newaxis])
+    take = np.empty_like(take_sorted)
+    take[:, order] = take_sorted
+    return above | take
 
-def proc_rec_df(rec_df):
+
+def proc_rec_df(rec_df, n=30, by=None):
     """ This function takes a dataframe with the recommendations for a given
     ticker and performs the following operations **in this order**:
 
-    1. Keep only the top 30 firms (in terms of number of recommendations over
-       the entire sample period) for this ticker (see Notes below).
+    1. Keep only the top `n` (30 by default) firms (in terms of number of
+       recommendations over the entire sample period) for this ticker (see
+       Notes below).
 
     2. Keep only recommendations that represent either an upgrade or a
        downgrade (that is, the values of `rec_df['action']` are either 'up' or
@@ -460,6 +1782,14 @@ def proc_rec_df(rec_df):
     rec_df : dataframe
         Dataframe produced by the function `read_rec_csv` created above.
 
+    n : int, optional
+        Number of firms to keep.
+
+    by : str, optional
+        Column of `rec_df` identifying the ticker, if `rec_df` contains the
+        recommendations of several tickers. The top `n` firms are then
+        selected separately for each ticker, in one call.
+
 
     Returns
     -------
@@ -477,7 +1807,7 @@ def proc_rec_df(rec_df):
 
     Notes
     -----
-    - To select the top 30 firms:
+    - To select the top 30 firms (see `top_n_mask`):
 
         1. Count the number of observations for each individual value of the
         column 'firm'.
@@ -510,31 +1840,51 @@ def proc_rec_df(rec_df):
     # --------------------------------------------------------
     #   Get top 30 firms
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    # Make sure 'firm' and 'action' use the shared codes
+    rec_df = rec_df.assign(firm=mk_shared_cat('firm', rec_df['firm']),
+                           action=mk_shared_cat('action', rec_df['action']))
+
+    # Count the recommendations of each (ticker, firm code)
+    firm_codes = rec_df['firm'].cat.codes.values
+    if by is None:
+        group_codes = np.zeros(len(rec_df), dtype=np.intp)
+        n_groups = 1
+    else:
+        group_codes, groups = pd.factorize(rec_df[by])
+        n_groups = len(groups)
+    n_firms = len(CODE_TABLES['firm'])
+    has_firm = firm_codes >= 0
+    counts = np.bincount(group_codes[has_firm] * n_firms + firm_codes[has_firm],
+                         minlength=n_groups * n_firms).reshape(n_groups, n_firms)
+    is_top = top_n_mask(counts, n, alpha_rank('firm'))
 
     # --------------------------------------------------------
     #   Subset the DF to include only these firms
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    rec_df = rec_df.loc[has_firm & is_top[group_codes, firm_codes]]
 
     # --------------------------------------------------------
     #  Keep only the columns we want
     #   cols = ['event_day', 'firm', 'action']
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    cols = ['event_day', 'firm', 'action']
+    if by is not None:
+        cols.append(by)
+    rec_df = rec_df.loc[:, cols]
 
     # --------------------------------------------------------
     #  Keep only values of 'action' that are either 'up' or 'down'
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    up_down = [code_of('action', 'up'), code_of('action', 'down')]
+    rec_df = rec_df.loc[np.isin(rec_df['action'].cat.codes.values, up_down)]
 
     # --------------------------------------------------------
     #  Return the dataframe
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    return rec_df
 
 
-def mk_event_df(rec_df):
+def mk_event_df(rec_df, by=None):
     """ This function takes a dataframe with the upgrades and downgrades
     for a given ticker and performs the following actions **in this order**:
 
@@ -568,6 +1918,12 @@ def mk_event_df(rec_df):
     rec_df : dataframe
         Dataframe produced by the function `proc_rec_df` created above.
 
+    by : str, optional
+        Column of `rec_df` identifying the ticker, if `rec_df` contains the
+        recommendations of several tickers. The events of each ticker are
+        then created as above, in one call: the event IDs start at 1 for
+        each ticker, and the column `by` is added at the end.
+
 
     Returns
     -------
@@ -605,43 +1961,73 @@ def mk_event_df(rec_df):
          #   Column      Non-Null Count  Dtype
         ---  ------      --------------  -----
          0   event_id    42 non-null     int64
-         1   event_day   42 non-null     object
-         2   firm        42 non-null     object
-         3   event_type  42 non-null     object
+         1   event_day   42 non-null     datetime64[ns]
+         2   firm        42 non-null     category
+         3   event_type  42 non-null     category
+
+    - 'firm' and 'event_type' use the shared codes in `CODE_TABLES`, and
+      the score, grouping and filtering above all work on these codes.
 
     """
     # --------------------------------------------------------
     #   Create the score column
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    action_codes = shared_codes('action', rec_df['action'])
+    score = ((action_codes == code_of('action', 'up')).astype(np.int64)
+             - (action_codes == code_of('action', 'down')))
+    rec_df = rec_df.assign(score=score)
 
     # --------------------------------------------------------
     #   Create group obj
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    # Grouping on the categorical 'firm' groups on its integer codes
+    keys = ['event_day', 'firm'] if by is None else [by, 'event_day', 'firm']
+    groups = rec_df.groupby(keys, observed=True)
+    event_df = groups['score'].sum().reset_index()
 
     # --------------------------------------------------------
     #   Create the event_type column and keep only the rows for
     #   which event_types takes the values 'downgrade' or 'upgrade'
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    score = event_df['score'].values
+    type_codes = np.where(score > 0, code_of('event_type', 'upgrade'),
+                          np.where(score < 0, code_of('event_type', 'downgrade'), -1))
+    event_df = event_df.loc[type_codes >= 0]
+    event_df = event_df.assign(event_type=pd.Categorical.from_codes(
+        type_codes[type_codes >= 0], categories=CODE_TABLES['event_type']))
+
+    # Order the events by day, then by firm name (within each ticker)
+    firm_rank = alpha_rank('firm')[shared_codes('firm', event_df['firm'])]
+    sort_keys = (firm_rank, event_df['event_day'].values)
+    if by is not None:
+        sort_keys += (pd.factorize(event_df[by], sort=True)[0],)
+    event_df = event_df.iloc[np.lexsort(sort_keys)]
 
     # --------------------------------------------------------
     #   Create the event_id column
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    if by is None:
+        event_id = np.arange(1, len(event_df) + 1)
+    else:
+        event_id = event_df.groupby(by, observed=True).cumcount().values + 1
+    event_df.insert(0, 'event_id', event_id)
+    event_df.index = range(len(event_df))
 
     # --------------------------------------------------------
     #   Return the dataframe
     # --------------------------------------------------------
-    # <COMPLETE THIS PART>
+    cols = ['event_id', 'event_day', 'firm', 'event_type']
+    if by is not None:
+        cols.append(by)
+    return event_df.loc[:, cols]
 
 
 # ----------------------------------------------------------------------------
 #   Create a dataframe with event time
 # ----------------------------------------------------------------------------
 def mk_ret_dates_by_group(group):
-    """ For a given group by event_id, preform the following operations (in
+    """ For a given group by event_id (or any rows of the expanded event
+    dataframe, see `mk_ret_dates`), preform the following operations (in
     this order):
 
     1. Create a column called "event_date", with the datetime representation
@@ -718,10 +2104,10 @@ def mk_ret_dates_by_group(group):
     # Create the event date col
     # --------------------------------------------------------
     # Create the event date col
-    group.loc[:, 'event_date'] = '<COMPLETE THIS PART>'
+    group.loc[:, 'event_date'] = pd.to_datetime(group['event_day'])
 
     # Create the return date
-    group.loc[:, 'ret_date'] = group.event_date + '<COMPLETE THIS PART>'
+    group.loc[:, 'ret_date'] = group.event_date + pd.to_timedelta(group['event_time'], unit='D')
 
     # --------------------------------------------------------
     # Leave this here
@@ -731,20 +2117,75 @@ def mk_ret_dates_by_group(group):
     return group
 
 
+def mk_trading_ret_dates(df, event_df, calendar):
+    """ Same as `mk_ret_dates_by_group` for the expanded events `df` (built
+    from `event_df` by `mk_ret_dates`), but with 'event_time' counted in
+    trading days of `calendar`. Also adds the column 'ret_pos' (see
+    `mk_ret_dates`).
+
+    Only the benchmarks use this (`mk_cars` reads the windows from
+    `mk_car_index` with `window_cars`), so the ends of `calendar` are
+    handled as in `window_cars`.
+
+    """
+    cols = ['event_id', 'firm', 'event_date',
+            'event_time', 'ret_date', 'event_type', 'ret_pos']
+    cal = np.asarray(calendar.values, dtype='datetime64[ns]')
+    n_times = len(df) // max(len(event_df), 1)
+    event_times = df['event_time'].values[:n_times]
+
+    # Position of day 0 of each event, looked up once per event
+    event_days = np.asarray(event_df['event_day'].values, dtype='datetime64[ns]')
+    day0 = np.searchsorted(cal, event_days)
+    # A window cut by either end of the calendar is dropped as a whole, and
+    # events after the last trading day have no day 0
+    in_cal = day0 < len(cal)
+    if n_times:
+        in_cal &= (day0 + event_times[0] >= 0) & (day0 + event_times[-1] < len(cal))
+    day0 = np.repeat(day0, n_times)
+    in_cal = np.repeat(in_cal, n_times)
+    ret_pos = day0 + df['event_time'].values
+
+    df.loc[:, 'event_date'] = pd.to_datetime(df['event_day'])
+    df.loc[:, 'ret_date'] = np.where(in_cal, cal[np.clip(ret_pos, 0, max(len(cal) - 1, 0))],
+                                     np.datetime64('NaT'))
+    df.loc[:, 'ret_pos'] = np.where(in_cal, ret_pos, -1)
+    return df.loc[:, cols].copy()
+
+
 # ----------------------------------------------------------------------------
-#   You need to complete the docstring for this function
-#   Do not modify the body of the function
+#   Function mk_ret_dates
 # ----------------------------------------------------------------------------
-def mk_ret_dates(event_df, window=2):
-    """ [<COMPLETE THIS PART>
+def mk_ret_dates(event_df, window=2, calendar=None):
+    """ Expands each event in `event_df` into the days of the window
+    surrounding it, from `window` days before the event to `window` days
+    after it.
 
     Parameters
     ----------
-    [<COMPLETE THIS PART>
+    event_df : dataframe
+        Dataframe produced by the function `mk_event_df` above
+
+    window : int, optional
+        Number of days before and after the event day to include
+
+    calendar : DatetimeIndex, optional
+        Sorted trading days (e.g. `aret_df.index`). If given, the window is
+        counted in trading days: day 0 is the first trading day on or after
+        the event day, found by binary search. Otherwise the window is
+        counted in calendar days. Only the benchmarks pass a calendar.
 
     Returns
     ------
-    [<COMPLETE THIS PART>
+    dataframe
+        A Pandas dataframe with 2 x `window` + 1 rows per event and the
+        columns ['event_id', 'firm', 'event_date', 'event_time', 'ret_date',
+        'event_type'] (see `mk_ret_dates_by_group`).
+
+        With a `calendar`, there is also a column 'ret_pos' with the
+        position of 'ret_date' in `calendar`. It is -1, and 'ret_date' is
+        NaT, for every day of the events whose window does not fit in the
+        calendar (see `window_cars`).
 
     """
 
@@ -766,10 +2207,12 @@ def mk_ret_dates(event_df, window=2):
     # | 1        | Wunderlich | 2012-02-16 | downgrade  |
     # | 1        | Wunderlich | 2012-02-16 | downgrade  |
     # | 1        | Wunderlich | 2012-02-16 | downgrade  |
-    def mk_copies(row):
-        return row.repeat(2 * window + 1)
-
-    df = event_df.apply(mk_copies, axis=0)
+    #
+    # All the rows are repeated at once (in event_id order)
+    event_times = np.arange(-window, window + 1)
+    event_df = event_df.sort_values('event_id', kind='stable')
+    df = event_df.iloc[np.repeat(np.arange(len(event_df)), len(event_times))]
+    df = df.reset_index(drop=True)
 
     # --------------------------------------------------------
     #   Create an event_time column so that the DF now becomes
@@ -784,12 +2227,7 @@ def mk_ret_dates(event_df, window=2):
     # | 1        | Wunderlich | 2012-02-16 | downgrade  | 0          |
     # | 1        | Wunderlich | 2012-02-16 | downgrade  | 1          |
     # | 1        | Wunderlich | 2012-02-16 | downgrade  | 2          |
-    def mk_et(group):
-        group['event_time'] = [i for i in range(-window, window + 1)]
-        return group
-
-    groups = df.groupby('event_id')
-    df = groups.apply(mk_et)
+    df.loc[:, 'event_time'] = np.tile(event_times, len(event_df))
 
     # --------------------------------------------------------
     #   Create ret dates
@@ -803,17 +2241,127 @@ def mk_ret_dates(event_df, window=2):
     # | 1        | Wunderlich | 2012-02-16 | 0          | 2012-02-16 | downgrade  |
     # | 1        | Wunderlich | 2012-02-16 | 1          | 2012-02-17 | downgrade  |
     # | 1        | Wunderlich | 2012-02-16 | 2          | 2012-02-18 | downgrade  |
-    groups = df.groupby('event_id')
-    df = groups.apply(mk_ret_dates_by_group)
+    #
+    # mk_ret_dates_by_group works on any rows, so it is called once on all
+    # the events instead of once per event_id
+    if calendar is None:
+        df = mk_ret_dates_by_group(df)
+    else:
+        df = mk_trading_ret_dates(df, event_df, calendar)
     df.index = range(len(df.index))
 
-    return df.copy()
+    return df
+
+
+# ----------------------------------------------------------------------------
+#   CAR index
+# ----------------------------------------------------------------------------
+def mk_car_index(aret_df):
+    """ Creates the cumulative sums of the abnormal returns in `aret_df`, so
+    that the CAR over any rows `start` to `end` (inclusive) of a column is
+    `car_index[end + 1] - car_index[start]`.
+
+    Parameters
+    ----------
+    aret_df : dataframe
+        A dataframe with abnormal returns (output of `mk_aret_df`)
+
+    Returns
+    ------
+    numpy array
+        An array with one more row than `aret_df` (the first row is zeros)
+        and one column per column of `aret_df`. Missing abnormal returns
+        count as zero, as in a pandas sum.
+
+    """
+    arets = aret_df.values
+    car_index = np.zeros((arets.shape[0] + 1, arets.shape[1]), dtype='float64')
+    np.cumsum(np.nan_to_num(arets, nan=0.0), axis=0, out=car_index[1:])
+    return car_index
+
+
+def window_label(window):
+    """ Returns the label of the event window `window` in the CAR dataframes
+    (e.g. '[-2, 2]' for the window (-2, 2))
+
+    """
+    return '[{}, {}]'.format(*window)
+
+
+def window_cars(car_index, calendar, event_days, windows=((-2, 2),), col=None):
+    """ Computes the CAR of every event over each window from a column of
+    `car_index` (column `col[e]` for event `e` if `col` is given).
+
+    Parameters
+    ----------
+    car_index : numpy array
+        One column of the output of `mk_car_index` (or all of it with `col`)
+
+    calendar : DatetimeIndex
+        The trading days of `car_index` (the index of `aret_df`)
+
+    event_days : array
+        The event days. Day 0 of an event is the first trading day on or
+        after its event day.
+
+    windows : list, optional
+        First and last trading day of each window, relative to day 0
+
+    col : array, optional
+        Column of `car_index` of each event
+
+    Returns
+    ------
+    tuple
+        The CARs as an array with one row per event and one column per
+        window, and a boolean array of the same shape which is False where
+        the CAR is NaN: where the window does not fit in `calendar` (it
+        starts before the first trading day or ends after the last one),
+        and for the events after the last trading day. Windows cut by the
+        ends of `calendar` are dropped rather than summed over fewer days.
+
+    """
+    cal = np.asarray(calendar.values, dtype='datetime64[ns]')
+    day0 = np.searchsorted(cal, np.asarray(event_days, dtype='datetime64[ns]'))
+    windows = np.asarray(windows, dtype='int64').reshape(-1, 2)
+
+    # Day 0 is looked up once, then shifted for every window
+    start = day0[:, np.newaxis] + windows[:, 0]
+    end = day0[:, np.newaxis] + windows[:, 1]
+    valid = (start >= 0) & (end < len(cal)) & (day0 < len(cal))[:, np.newaxis]
+    end, start = np.where(valid, end + 1, 0), np.where(valid, start, 0)
+    if col is None:
+        cars = car_index[end] - car_index[start]
+    else:
+        cars = car_index[end, col[:, np.newaxis]] - car_index[start, col[:, np.newaxis]]
+    cars[~valid] = np.nan
+    return cars, valid
+
+
+def mk_cars_df(event_df, tics, car, valid, windows):
+    """ Returns the CAR dataframe of `mk_cars` (and `mk_universe_cars`): one
+    row per event of `event_df` and window with a valid CAR, with the columns
+    ['event_id', 'event_type', 'tic', 'window', 'car'].
+
+    `tics` is the ticker of each event, and `car` and `valid` are the output
+    of `window_cars` for the events and `windows`. The columns are built
+    from arrays, so events without a valid CAR give an empty dataframe with
+    the same columns.
+
+    """
+    event_pos, window_pos = np.nonzero(valid)
+    labels = [window_label(w) for w in windows]
+    cars = event_df.loc[:, ['event_id', 'event_type']].iloc[event_pos]
+    return cars.reset_index(drop=True).assign(
+        tic=np.asarray(tics, dtype=object)[event_pos],
+        window=pd.Categorical.from_codes(window_pos, categories=labels),
+        car=car[event_pos, window_pos])
 
 
 # ----------------------------------------------------------------------------
-#   Function to create CARs. Do not modify this function
+#   Function to create CARs
 # ----------------------------------------------------------------------------
-def mk_cars(tic, aret_df):
+def mk_cars(tic, aret_df, windows=((-2, 2),), car_index=None):
     """ For a given ticker, create compute the cumulative abnormal return (CAR) for each
     event ID and each event type (downgrade or upgrade).
 
@@ -825,6 +2373,21 @@ def mk_cars(tic, aret_df):
     aret_df : dataframe
         A dataframe with abnormal returns (output of `mk_aret_df`.
 
+    windows : list, optional
+        First and last trading day of each event window, relative to the
+        first trading day on or after the event day
+
+    car_index : numpy array, optional
+        Output of `mk_car_index(aret_df)`. Pass it when computing the CARs
+        of many tickers, so it is only created once.
+
+    Returns
+    ------
+    dataframe
+        One row per event and window, with the columns ['event_id',
+        'event_type', 'tic', 'window', 'car'] ('window' is labelled by
+        `window_label`)
+
     """
     # --------------------------------------------------------
     #   Get recommendations
@@ -838,47 +2401,25 @@ def mk_cars(tic, aret_df):
     event_df = mk_event_df(rec_df)
 
     # --------------------------------------------------------
-    #   Expand calendar dates dates for window surrounding the event
-    # --------------------------------------------------------
-    # Apply the function to each group
-    event_df = mk_ret_dates(event_df)
-
-    # --------------------------------------------------------
-    #   Get abnormal returns for this ticker
+    #   Get the cumulative abnormal returns for this ticker
     # --------------------------------------------------------
-    # add returns
     # ---------- Leave this here -----
     tic = tic.lower().strip()
-    aret_tic = aret_df.loc[:, [tic]].copy()
-    # --------------------------------------------------------
-    #   Create a column with calendar dates in the ARet datafrae
-    # --------------------------------------------------------
-    aret_tic.loc[:, 'ret_date'] = aret_tic.index.values
-    # --------------------------------------------------------
-    #   Rename the column with ARet from <tic> to 'aret'
-    # --------------------------------------------------------
-    aret_tic.rename(columns={tic: 'aret'}, inplace=True)
-
-    # --------------------------------------------------------
-    #   Add ARet to the event dataframe
-    # --------------------------------------------------------
-    event_df = event_df.join(aret_tic, how='inner', on='ret_date', rsuffix='_')
-    del event_df['ret_date_']
+    col = aret_df.columns.get_loc(tic)
+    if car_index is None:
+        car_index = mk_car_index(aret_df.iloc[:, [col]])
+        col = 0
 
     # --------------------------------------------------------
-    #   Create a column with the ticker
+    #   compute cumulative abnormal returns for each event and window
     # --------------------------------------------------------
-    event_df.loc[:, 'tic'] = tic
-
-    # --------------------------------------------------------
-    #   compute cumulative abnormal returns for each value of
-    #   - event_id
-    #   - event_type
-    #   - ticker
-    # ---------------------------------------------------------
-    groups = event_df.groupby(['event_id', 'event_type', 'tic'])
-    cars = groups['aret'].sum().reset_index()
-    cars.rename(columns={'aret': 'car'}, inplace=True)
+    # Each CAR is the difference of two cumulative sums, so the windows are
+    # never expanded into rows (windows that do not fit in the calendar are
+    # dropped, see `window_cars`)
+    car, valid = window_cars(car_index[:, col], aret_df.index,
+                             event_df['event_day'].values, windows)
+    cars = mk_cars_df(event_df, np.full(len(event_df), tic, dtype=object), car,
+                      valid, windows)
 
     # --------------------------------------------------------
     #   Return the CAR dataframe
@@ -886,18 +2427,142 @@ def mk_cars(tic, aret_df):
     return cars
 
 
+# ----------------------------------------------------------------------------
+#   CARs for all tickers
+# ----------------------------------------------------------------------------
+# CAR_SHARED holds, in each worker process of `mk_all_cars`, the abnormal
+# returns and the CAR index. They are memory-mapped from files written once
+# by the parent process, so they are not pickled for each ticker.
+CAR_SHARED = {}
+
+
+def init_car_worker(shared_dir, index, columns):
+    """ Maps the arrays saved by `mk_all_cars` in `shared_dir` into
+    `CAR_SHARED` (runs once in each worker process)
+
+    """
+    arets = np.load(os.path.join(shared_dir, 'aret.npy'), mmap_mode='r')
+    CAR_SHARED['aret_df'] = pd.DataFrame(arets, index=index, columns=columns, copy=False)
+    CAR_SHARED['car_index'] = np.load(os.path.join(shared_dir, 'car_index.npy'),
+                                      mmap_mode='r')
+
+
+def shared_cars(tic, windows):
+    """ Calls `mk_cars` for `tic` with the arrays in `CAR_SHARED`
+
+    """
+    return mk_cars(tic, CAR_SHARED['aret_df'], windows, CAR_SHARED['car_index'])
+
+
+def mk_all_cars(tickers, aret_df, windows=CAR_WINDOWS, workers=1):
+    """ Computes the CARs of every ticker in `tickers` (see `mk_cars`).
+
+    Parameters
+    ----------
+    tickers : list
+        List of tickers in lower case characters and without spaces
+
+    aret_df : dataframe
+        A dataframe with abnormal returns (output of `mk_aret_df`)
+
+    windows : list, optional
+        Event windows of the CARs (see `CAR_WINDOWS`)
+
+    workers : int, optional
+        Number of processes used to compute the CARs. If 1 (the default),
+        the tickers are processed one after another in this process.
+
+    Returns
+    ------
+    dataframe
+        The CAR dataframes of all the tickers, one after another in the
+        order of `tickers` (the same for any number of workers)
+
+    """
+    car_index = mk_car_index(aret_df)
+    if workers > 1:
+        # The workers read aret_df and car_index from memory-mapped files,
+        # so only the ticker and the windows are sent with each task
+        with tempfile.TemporaryDirectory() as shared_dir:
+            np.save(os.path.join(shared_dir, 'aret.npy'), aret_df.values)
+            np.save(os.path.join(shared_dir, 'car_index.npy'), car_index)
+            chunksize = max(1, len(tickers) // (4 * workers))
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_car_worker,
+                                     initargs=(shared_dir, aret_df.index,
+                                               aret_df.columns)) as executor:
+                load = functools.partial(shared_cars, windows=windows)
+                cars_tic = map_stages(executor, 'mk_cars', load, tickers, chunksize)
+    else:
+        cars_tic = []
+        for tic in tickers:
+            with stage('mk_cars', tic=tic) as stats:
+                cars_tic.append(mk_cars(tic, aret_df, windows, car_index))
+                stats['rows_out'] = len(cars_tic[-1])
+    return pd.concat(cars_tic, ignore_index=True)
+
+
+def mk_universe_cars(tickers, aret_df, windows=CAR_WINDOWS):
+    """ Computes the same CARs as `mk_all_cars`, but processes the
+    recommendations of all the tickers together: one dataframe for all the
+    tickers (see `read_rec_csvs`), one call to `proc_rec_df` and
+    `mk_event_df` grouped by ticker, and one lookup of all the CARs in
+    `mk_car_index(aret_df)`.
+
+    """
+    # A ticker missing from aret_df raises, as in mk_cars
+    tic_col = aret_df.columns.get_indexer(tickers)
+    if (tic_col < 0).any():
+        missing = [tic for tic, j in zip(tickers, tic_col) if j < 0]
+        raise KeyError("tickers not in aret_df: {}".format(missing))
+
+    with stage('read_rec_csvs', rows_in=len(tickers)) as stats:
+        rec_df = read_rec_csvs(tickers)
+        stats['rows_out'] = len(rec_df)
+    with stage('proc_rec_df', rows_in=len(rec_df)) as stats:
+        rec_df = proc_rec_df(rec_df, by='tic')
+        stats['rows_out'] = len(rec_df)
+    with stage('mk_event_df', rows_in=len(rec_df)) as stats:
+        event_df = mk_event_df(rec_df, by='tic')
+        stats['rows_out'] = len(event_df)
+
+    # Column of aret_df of each event
+    with stage('window_cars', rows_in=len(event_df)) as stats:
+        col = tic_col[event_df['tic'].cat.codes.values]
+        car, valid = window_cars(mk_car_index(aret_df), aret_df.index,
+                                 event_df['event_day'].values, windows, col)
+        stats['rows_out'] = int(valid.sum())
+
+    # Same rows and columns as in mk_cars: by ticker, event and window
+    tics = np.asarray(tickers, dtype=object)[event_df['tic'].cat.codes.values]
+    return mk_cars_df(event_df, tics, car, valid, windows)
+
+
 # ----------------------------------------------------------------------------
 #   Main function
 # ----------------------------------------------------------------------------
-def main():
+def main(windows=CAR_WINDOWS):
     """ This function executes all the functions in this module in the
     correct order.
 
+    Parameters
+    ----------
+    windows : list, optional
+        Event windows of the CARs (see `CAR_WINDOWS`)
+
+    Notes
+    -----
+    If PROFILE is True, the statistics of each stage are printed as a
+    table and written to PROFILE_JSON (see `stage`).
+
     """
+    STAGE_STATS.clear()
+
     # --------------------------------------------------------
     #   Get the tickers
     # --------------------------------------------------------
-    tickers = get_tics(TICKERS)
+    with stage('get_tics') as stats:
+        tickers = get_tics(TICKERS)
+        stats['rows_out'] = len(tickers)
 
     # --------------------------------------------------------
     #   Create a dataframe with adj closing prices for each tic
@@ -908,34 +2573,57 @@ def main():
         'src_cols': SRC_COLS,
         'src_col_dtypes': SRC_COL_DTYPES,
         'src_col_widths': SRC_COL_WIDTHS,
+        'workers': WORKERS,
+        'cache_dir': CACHEDIR,
     }
-    prc_df = mk_prc_df(**kargs)
+    with stage('mk_prc_df', rows_in=len(tickers)) as stats:
+        prc_df = mk_prc_df(**kargs)
+        stats['rows_out'] = len(prc_df)
 
     # --------------------------------------------------------
     #   Create a dataframe with Abnormal returns for each tic
     # --------------------------------------------------------
-    aret_df = mk_aret_df(prc_df)
+    with stage('mk_aret_df', rows_in=len(prc_df)) as stats:
+        aret_df = mk_aret_df(prc_df)
+        stats['rows_out'] = len(aret_df)
 
     # --------------------------------------------------------
-    #   Compile CARs for each event
+    #   Compile CARs for each event and window
     #   The dataframe cars will have the following form:
     #
-    #   Data columns (total 4 columns):
+    #   Data columns (total 5 columns):
     #    #   Column      Non-Null Count  Dtype
     #   ---  ------      --------------  -----
-    #    0   event_id    1080 non-null   int64
-    #    1   event_type  1080 non-null   object
-    #    2   tic         1080 non-null   object
-    #    3   car         1080 non-null   float64
+    #    0   event_id    1009 non-null   int64
+    #    1   event_type  1009 non-null   category
+    #    2   tic         1009 non-null   object
+    #    3   window      1009 non-null   category
+    #    4   car         1009 non-null   float64
+    #
+    #   (1009 rows for each window in `windows`)
     # --------------------------------------------------------
-    cars = pd.concat([mk_cars(t, aret_df) for t in tickers], ignore_index=True)
+    with stage('cars', rows_in=len(tickers)) as stats:
+        if BATCHED:
+            cars = mk_universe_cars(tickers, aret_df, windows)
+        else:
+            cars = mk_all_cars(tickers, aret_df, windows, WORKERS)
+        stats['rows_out'] = len(cars)
 
     # --------------------------------------------------------
-    #   Calculate the average CAR by event_type
+    #   Calculate the average CAR by window and event_type
     # --------------------------------------------------------
-    cars_by_etype = cars.groupby(['event_type'])[['car']].mean()
+    with stage('cars_by_etype', rows_in=len(cars)) as stats:
+        cars_by_etype = cars.groupby(['window', 'event_type'], observed=True)[['car']].mean()
+        stats['rows_out'] = len(cars_by_etype)
     # print(cars_by_etype)
 
+    # --------------------------------------------------------
+    #   Report the stage statistics
+    # --------------------------------------------------------
+    if PROFILE:
+        print(profile_table(STAGE_STATS))
+        write_profile(PROFILE_JSON, STAGE_STATS)
+
 
 # Doing this so it is run when running with the following syntax
 if __name__ == "__main__":